@@ -31,36 +31,96 @@ python Get_started_LiveAPI.py --mode screen
 ```
 """
 
+import argparse
 import asyncio
 import base64
+import contextlib
+import functools
+import importlib
+import inspect
 import io
+import json
+import math
 import os
+import platform
+import queue
+import re
+import struct
 import sys
+import threading
+import time
 import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-import cv2
-import pyaudio
-import PIL.Image
-import mss
-
-import argparse
-
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set")
-from PIL import ImageDraw
-import pyautogui
+
+
+class _LazyModule:
+    """
+    Module stand-in that imports the real module on first attribute access.
+    Heavy dependencies (OpenCV, mss, pyautogui, pynput, PyAudio, google-genai)
+    load only when a mode or tool actually uses them.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}' ({'loaded' if self._module is not None else 'not loaded'})>"
+
+
+class _LazyObject:
+    """Proxy that builds its object on first attribute read or write (e.g. pynput controllers)."""
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_obj", None)
+
+    def _get(self):
+        if self._obj is None:
+            object.__setattr__(self, "_obj", self._factory())
+        return self._obj
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._get(), attr, value)
+
+
+cv2 = _LazyModule("cv2")
+np = _LazyModule("numpy")
+mss = _LazyModule("mss")
+httpx = _LazyModule("httpx")
+pyaudio = _LazyModule("pyaudio")
+pyautogui = _LazyModule("pyautogui")
+Image = _LazyModule("PIL.Image")
+genai = _LazyModule("google.genai")
+types = _LazyModule("google.genai.types")
+mouse = _LazyModule("pynput.mouse")
+keyboard = _LazyModule("pynput.keyboard")
+
 if sys.version_info < (3, 11, 0):
     import taskgroup, exceptiongroup
 
     asyncio.TaskGroup = taskgroup.TaskGroup
     asyncio.ExceptionGroup = exceptiongroup.ExceptionGroup
 
-FORMAT = pyaudio.paInt16
+FORMAT = 8  # pyaudio.paInt16 (literal so PyAudio is only loaded when a stream opens)
+# PortAudio callback flags and return codes, as literals for the same reason
+# (the synthetic audio backend drives the callbacks without PyAudio installed)
+PA_CONTINUE = 0             # pyaudio.paContinue
+PA_INPUT_OVERFLOW = 2       # pyaudio.paInputOverflow
+PA_OUTPUT_UNDERFLOW = 4     # pyaudio.paOutputUnderflow
 CHANNELS = 1
 SEND_SAMPLE_RATE = 16000
 RECEIVE_SAMPLE_RATE = 24000
@@ -69,23 +129,16 @@ CHUNK_SIZE = 1024
 MODEL = "gemini-2.5-flash-native-audio-preview-09-2025"
 
 DEFAULT_MODE = "camera"
-from pynput import mouse
-from pynput import keyboard
-import pyautogui
-import mss
-import numpy as np
-import cv2
-client = genai.Client(api_key=GOOGLE_API_KEY)
 
-# Global mouse controller for reliability (avoids creating new instances)
-_MOUSE_CONTROLLER = mouse.Controller()
+# Global mouse/keyboard controllers for reliability (avoids creating new
+# instances); created on first use so importing needs no display.
+_MOUSE_CONTROLLER = _LazyObject(lambda: mouse.Controller())
+_KEYBOARD_CONTROLLER = _LazyObject(lambda: keyboard.Controller())
 
 
 def capture_screen_sync():
     try:
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            return np.array(sct.grab(monitor))
+        return _CAPTURE_SELECTOR.grab_bgra()[0]
     except Exception as e:
         raise RuntimeError(
             "❌ Screen capture failed! On macOS, grant Screen Recording permission:\n"
@@ -94,14 +147,871 @@ def capture_screen_sync():
             f"Original error: {e}"
         )
 
-import os
-import time
-import cv2
-import numpy as np
-import threading
-import mss
-from google import genai
-from google.genai import types
+
+# === Metrics ===
+class LatencyStats:
+    """Running count/mean/max plus percentiles over a sliding window (values in seconds)."""
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._recent.append(value)
+
+    def percentile(self, q):
+        """Nearest-rank percentile of the recent window."""
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+    def summary(self):
+        """Summary in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+# === Tracing ===
+# Pipeline stages timed by Tracer spans (time.monotonic() seconds):
+#   capture / encode        screen or camera frame (attr source)
+#   uplink.queue_wait       time a message sat in out_queue (attr lane)
+#   uplink.send             send_realtime_input call (attr lane)
+#   tool.arrival            end of the user's request -> tool_call received
+#   tool.exec               one function call in the ToolExecutor (attr tool)
+#   tool.response_send      send_tool_response call
+#   audio.first_byte        end of the user's request (or tool response) -> first audio chunk
+METRICS_HOST = "127.0.0.1"
+METRICS_PREFIX = "desktop_agent"
+
+
+class Tracer:
+    """
+    Records pipeline spans, aggregates them per stage and optionally appends
+    each span as a JSON line to trace_path. Safe to call from worker threads.
+    """
+
+    def __init__(self, trace_path=None, window=2048):
+        self.window = window
+        self.stages = {}
+        self.on_span = None  # optional callback(stage, start, end, attrs), e.g. SessionRecorder.span
+        self._lock = threading.Lock()
+        self._file = None
+        if trace_path:
+            self._file = open(trace_path, "a", buffering=1)
+            self._write({"type": "start", "wall_time": time.time(), "monotonic": time.monotonic()})
+
+    def _write(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+
+    def record(self, stage, start, end, **attrs):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = LatencyStats(self.window)
+            stats.add(end - start)
+        if self.on_span is not None:
+            self.on_span(stage, start, end, attrs)
+        if self._file is not None:
+            self._write({"type": "span", "stage": stage, "start": round(start, 6), "end": round(end, 6),
+                         "duration_ms": round((end - start) * 1000, 3), **attrs})
+
+    @contextlib.contextmanager
+    def span(self, stage, **attrs):
+        """Time a block. The yielded dict can be filled with extra attributes."""
+        start = time.monotonic()
+        try:
+            yield attrs
+        finally:
+            self.record(stage, start, time.monotonic(), **attrs)
+
+    def summary(self):
+        with self._lock:
+            return {stage: stats.summary() for stage, stats in self.stages.items()}
+
+    def prometheus_text(self):
+        """Per-stage latency as a Prometheus summary (text exposition format)."""
+        name = f"{METRICS_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} Latency of each pipeline stage.", f"# TYPE {name} summary"]
+        with self._lock:
+            for stage, stats in sorted(self.stages.items()):
+                for q in (50, 95, 99):
+                    lines.append(f'{name}{{stage="{stage}",quantile="{q / 100}"}} {stats.percentile(q):.6f}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {stats.count}')
+        return "\n".join(lines) + "\n"
+
+    async def _handle_metrics(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[1:2] == [b"/metrics"]:
+                status, body = "200 OK", self.prometheus_text().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_metrics(self, port, host=METRICS_HOST):
+        """Serve GET /metrics on host:port until cancelled."""
+        server = await asyncio.start_server(self._handle_metrics, host, port)
+        print(f"[LOG] Metrics at http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# === Gemini client ===
+# One shared client for the Live session and the vision tools. The vision
+# tools use client.aio, whose httpx pool keeps the TLS connection warm
+# between tool calls. GEMINI_API_BASE_URL points it at a local HTTP stand-in.
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL")
+VISION_MAX_CONNECTIONS = 4
+VISION_KEEPALIVE_EXPIRY = 120.0  # seconds an idle pooled connection is kept
+
+
+class HttpCallStats:
+    """Connect and request timings of the async vision HTTP calls."""
+
+    def __init__(self):
+        self.connect = LatencyStats()
+        self.request = LatencyStats()
+        self.calls = 0
+        self.new_connections = 0
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "new_connections": self.new_connections,
+            "connect": self.connect.summary(),
+            "request": self.request.summary(),
+        }
+
+
+_VISION_HTTP_STATS = HttpCallStats()
+
+
+class _TimedTransportMixin:
+    """
+    Pooled httpx transport that records, per request, the TCP+TLS connect
+    time (only when a new connection was opened) and the time to response
+    headers, using httpcore's trace events. Mixed into httpx's transport by
+    _timed_transport_class() so httpx is only imported with the client.
+    """
+
+    async def handle_async_request(self, request):
+        timings = {}
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                timings["connect_started"] = time.perf_counter()
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                timings["connect_done"] = time.perf_counter()
+
+        request.extensions["trace"] = trace
+        started = time.perf_counter()
+        response = await super().handle_async_request(request)
+        elapsed = time.perf_counter() - started
+
+        _VISION_HTTP_STATS.calls += 1
+        _VISION_HTTP_STATS.request.add(elapsed)
+        connect_time = None
+        if "connect_started" in timings and "connect_done" in timings:
+            connect_time = timings["connect_done"] - timings["connect_started"]
+            _VISION_HTTP_STATS.new_connections += 1
+            _VISION_HTTP_STATS.connect.add(connect_time)
+        print(f"[LOG] HTTP {request.method} {request.url.path}: "
+              f"connect {'reused' if connect_time is None else f'{connect_time * 1000:.0f} ms'}, "
+              f"response headers after {elapsed * 1000:.0f} ms")
+        return response
+
+
+@functools.lru_cache(maxsize=None)
+def _timed_transport_class():
+    return type("_TimedAsyncTransport", (_TimedTransportMixin, httpx.AsyncHTTPTransport), {})
+
+
+def make_genai_client(api_key=None, base_url=GEMINI_API_BASE_URL):
+    api_key = api_key or GOOGLE_API_KEY
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set")
+    transport = _timed_transport_class()(limits=httpx.Limits(
+        max_connections=VISION_MAX_CONNECTIONS,
+        max_keepalive_connections=VISION_MAX_CONNECTIONS,
+        keepalive_expiry=VISION_KEEPALIVE_EXPIRY,
+    ))
+    http_options = types.HttpOptions(base_url=base_url or None, async_client_args={"transport": transport})
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+_CLIENT = None
+
+
+def get_client():
+    """The shared client, created on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = make_genai_client()
+    return _CLIENT
+
+
+# === Screen capture engine ===
+class ScreenCaptureEngine:
+    """
+    Long-lived mss capture context with reusable output buffers.
+
+    mss handles are not safe to share between threads, so use
+    get_capture_engine() to get the instance that belongs to the calling
+    thread instead of creating one per grab.
+
+    - grab_bgra() returns a zero-copy numpy view over the buffer mss just
+      filled (mss allocates a fresh one per grab, so the view stays valid).
+    - grab_bgr() converts into a preallocated BGR buffer (the only copy).
+      That buffer is reused by the next grab_bgr() on the same thread;
+      call .copy() if you need to keep it around.
+    """
+
+    def __init__(self):
+        self._sct = mss.mss()
+        self._bgr = None
+        self.grabs = 0
+
+    @property
+    def monitors(self):
+        return self._sct.monitors
+
+    def grab_bgra(self, monitor=1):
+        """Grab a monitor (index or mss monitor dict) as a HxWx4 BGRA view."""
+        if isinstance(monitor, int):
+            monitor = self._sct.monitors[monitor]
+        shot = self._sct.grab(monitor)
+        self.grabs += 1
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+    def grab_bgr(self, monitor=1, reuse_buffer=True):
+        """
+        Grab a monitor into the engine's preallocated HxWx3 BGR buffer, or
+        into a new array with reuse_buffer=False (for callers that keep
+        the image across awaits, where another grab could overwrite it).
+        """
+        bgra = self.grab_bgra(monitor)
+        if not reuse_buffer:
+            return cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR)
+        shape = (bgra.shape[0], bgra.shape[1], 3)
+        if self._bgr is None or self._bgr.shape != shape:
+            self._bgr = np.empty(shape, dtype=np.uint8)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=self._bgr)
+        return self._bgr
+
+    def close(self):
+        self._sct.close()
+
+
+_CAPTURE_LOCAL = threading.local()
+
+
+def get_capture_engine():
+    """Return the ScreenCaptureEngine owned by the current thread."""
+    engine = getattr(_CAPTURE_LOCAL, "engine", None)
+    if engine is None:
+        engine = ScreenCaptureEngine()
+        _CAPTURE_LOCAL.engine = engine
+    return engine
+
+
+# === Capture regions ===
+# Every screen image (streaming, detection, quiz) comes from the same
+# CaptureSelector, and every image carries the CaptureRegion it covers in
+# global (virtual desktop) coordinates. Image <-> global mapping only
+# happens through CaptureRegion.to_global / to_local.
+#
+# Global coordinates are the ones the mouse uses. On HiDPI displays (macOS
+# Retina) mss reports monitors in those logical points but grabs physical
+# pixels, so images are scaled down before anything encodes them and the
+# region records the resulting image-pixels-per-point scale.
+CAPTURE_MONITOR = "cursor"   # "all", "cursor" (monitor under the mouse) or a monitor index (1 = primary)
+CAPTURE_REGION = "none"      # "none", "window", "target" or "x,y,w,h" in global coordinates
+CAPTURE_SCALE = "logical"    # "logical" (mouse resolution), "native" (physical pixels) or a max longest side in pixels
+TARGET_REGION_SIZE = (1280, 800)  # region kept around the last detected target
+
+
+def parse_capture_scale(spec):
+    """Validate a capture scale: "logical", "native" or a positive max longest side (returned as int)."""
+    spec = str(spec)
+    if spec in ("logical", "native"):
+        return spec
+    try:
+        longest = int(spec)
+    except ValueError:
+        longest = 0
+    if longest <= 0:
+        raise ValueError(f"Capture scale must be logical, native or a positive pixel count, got '{spec}'")
+    return longest
+
+
+class CaptureRegion:
+    """
+    A rectangle in global screen coordinates (mss monitor layout), plus
+    the scale of the image captured from it (image pixels per global unit).
+    """
+
+    __slots__ = ("left", "top", "width", "height", "scale")
+
+    def __init__(self, left, top, width, height, scale=1.0):
+        self.left = int(left)
+        self.top = int(top)
+        self.width = max(1, int(width))
+        self.height = max(1, int(height))
+        self.scale = float(scale)
+
+    @classmethod
+    def from_monitor(cls, monitor):
+        return cls(monitor["left"], monitor["top"], monitor["width"], monitor["height"])
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse "x,y,w,h"."""
+        try:
+            left, top, width, height = (int(v) for v in spec.split(","))
+        except ValueError:
+            raise ValueError(f"Region must be 'x,y,w,h', got '{spec}'")
+        return cls(left, top, width, height)
+
+    @property
+    def monitor(self):
+        return {"left": self.left, "top": self.top, "width": self.width, "height": self.height}
+
+    def contains(self, x, y):
+        return self.left <= x < self.left + self.width and self.top <= y < self.top + self.height
+
+    def to_global(self, x, y):
+        """Image pixel -> global coordinates."""
+        return int(round(x / self.scale)) + self.left, int(round(y / self.scale)) + self.top
+
+    def to_local(self, x, y):
+        """Global coordinates -> image pixel."""
+        return int(round((x - self.left) * self.scale)), int(round((y - self.top) * self.scale))
+
+    def scaled(self, scale):
+        return CaptureRegion(self.left, self.top, self.width, self.height, scale)
+
+    def fit_within(self, bounds):
+        """Shift into bounds (keeping the size where possible), then clip to them."""
+        width = min(self.width, bounds.width)
+        height = min(self.height, bounds.height)
+        left = min(max(self.left, bounds.left), bounds.left + bounds.width - width)
+        top = min(max(self.top, bounds.top), bounds.top + bounds.height - height)
+        return CaptureRegion(left, top, width, height)
+
+    def __eq__(self, other):
+        return isinstance(other, CaptureRegion) and self.monitor == other.monitor
+
+    def __repr__(self):
+        scale = f" @{self.scale:g}x" if self.scale != 1.0 else ""
+        return f"CaptureRegion({self.left}, {self.top}, {self.width}x{self.height}{scale})"
+
+
+class CaptureSelector:
+    """
+    Decides which part of the desktop to capture.
+
+    monitor: "all" (bounding box of every display), "cursor" (the monitor
+    under the mouse) or a monitor index. region narrows it down: "window"
+    (the active window, needs pygetwindow; falls back to the monitor),
+    "target" (TARGET_REGION_SIZE around the last detected target) or a
+    fixed "x,y,w,h". Tracks how many pixels that saves against capturing
+    the whole desktop.
+
+    scale (default CAPTURE_SCALE) sets the image size: "logical" scales
+    physical HiDPI pixels down to one pixel per global unit, "native"
+    keeps them, a number caps the longest side (never upscaling). The
+    stats report pixels and raw bytes saved against native capture.
+    """
+
+    def __init__(self, monitor=None, region=None, scale=None):
+        self.monitor = monitor
+        self.region = region
+        self.scale = scale
+        self.last_target = None
+        self._pygetwindow = None
+        self._window_error = None
+
+        self.sources = {}
+        self.pixels_captured = 0
+        self.pixels_desktop = 0
+        self.pixels_native = 0
+        self.pixels_scaled = 0
+        self.bytes_native = 0
+        self.bytes_scaled = 0
+        self.last_scale = None
+
+    def set_target(self, x, y):
+        """Remember a detected target (global coordinates) for region="target"."""
+        self.last_target = (int(x), int(y))
+
+    def _monitor_region(self, monitors):
+        spec = str(self.monitor or CAPTURE_MONITOR)
+        if spec == "all":
+            return "all", CaptureRegion.from_monitor(monitors[0])
+        if spec == "cursor":
+            x, y = _MOUSE_CONTROLLER.position
+            for index, monitor in enumerate(monitors[1:], start=1):
+                region = CaptureRegion.from_monitor(monitor)
+                if region.contains(x, y):
+                    return f"monitor{index}", region
+            return "monitor1", CaptureRegion.from_monitor(monitors[1])
+        index = int(spec)
+        if not 0 <= index < len(monitors):
+            raise ValueError(f"Monitor {index} not found; {len(monitors) - 1} monitor(s) available")
+        return f"monitor{index}", CaptureRegion.from_monitor(monitors[index])
+
+    def _active_window_region(self):
+        if self._pygetwindow is None and self._window_error is None:
+            try:
+                import pygetwindow
+                self._pygetwindow = pygetwindow
+            except Exception as e:  # not installed, or unsupported platform (Linux)
+                self._window_error = str(e)
+                print(f"[LOG] Active window capture unavailable, using the monitor: {e}")
+        if self._pygetwindow is None:
+            return None
+        # On macOS getActiveWindow() returns the window title (a str), and
+        # other backends can return None; anything without a numeric,
+        # non-empty geometry falls back to the monitor.
+        try:
+            window = self._pygetwindow.getActiveWindow()
+            left, top, width, height = (window.left, window.top, window.width, window.height)
+            if not all(isinstance(v, (int, float)) for v in (left, top, width, height)):
+                return None
+        except Exception:
+            return None
+        if width <= 0 or height <= 0:
+            return None
+        return CaptureRegion(left, top, width, height)
+
+    def resolve(self, monitors):
+        """Return (source name, CaptureRegion) for the current settings and desktop state."""
+        desktop = CaptureRegion.from_monitor(monitors[0])
+        source, base = self._monitor_region(monitors)
+        region = self.region or CAPTURE_REGION
+        if region == "window":
+            window = self._active_window_region()
+            if window is not None:
+                return "window", window.fit_within(desktop)
+        elif region == "target":
+            if self.last_target is not None:
+                x, y = self.last_target
+                width, height = TARGET_REGION_SIZE
+                bounds = next((CaptureRegion.from_monitor(m) for m in monitors[1:]
+                               if CaptureRegion.from_monitor(m).contains(x, y)), base)
+                return "target", CaptureRegion(x - width // 2, y - height // 2, width, height).fit_within(bounds)
+        elif region != "none":
+            return "fixed", CaptureRegion.parse(region).fit_within(desktop)
+        return source, base
+
+    def target_size(self, region, native_width, native_height):
+        """Image size for a region grabbed at native_width x native_height pixels."""
+        spec = parse_capture_scale(CAPTURE_SCALE if self.scale is None else self.scale)
+        if spec == "native":
+            return native_width, native_height
+        # Logical size first; it is also the upper bound for a pixel cap
+        width, height = min(region.width, native_width), min(region.height, native_height)
+        if spec != "logical":
+            longest = spec
+            if max(width, height) > longest:
+                factor = longest / max(width, height)
+                width, height = max(1, round(width * factor)), max(1, round(height * factor))
+        return width, height
+
+    def _scale(self, frame, region):
+        """Resize a native grab to target_size(); returns (frame, region with its scale)."""
+        native_height, native_width = frame.shape[:2]
+        width, height = self.target_size(region, native_width, native_height)
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        self.pixels_native += native_width * native_height
+        self.pixels_scaled += width * height
+        self.bytes_native += native_width * native_height * channels
+        self.bytes_scaled += width * height * channels
+        self.last_scale = round(native_width / region.width, 3)
+        if (width, height) != (native_width, native_height):
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        return frame, region.scaled(width / region.width)
+
+    def grab_bgra(self, engine=None):
+        """Capture the selected region: (HxWx4 BGRA image, CaptureRegion)."""
+        engine = engine or get_capture_engine()
+        source, region = self.resolve(engine.monitors)
+        self._count(source, region, engine.monitors[0])
+        return self._scale(engine.grab_bgra(region.monitor), region)
+
+    def grab_bgr(self, engine=None, reuse_buffer=True):
+        """
+        Capture the selected region: (HxWx3 BGR image, CaptureRegion). A
+        scaled image is always a new array; otherwise see
+        ScreenCaptureEngine.grab_bgr for reuse_buffer.
+        """
+        engine = engine or get_capture_engine()
+        source, region = self.resolve(engine.monitors)
+        self._count(source, region, engine.monitors[0])
+        return self._scale(engine.grab_bgr(region.monitor, reuse_buffer=reuse_buffer), region)
+
+    def _count(self, source, region, desktop):
+        self.sources[source] = self.sources.get(source, 0) + 1
+        self.pixels_captured += region.width * region.height
+        self.pixels_desktop += desktop["width"] * desktop["height"]
+
+    def stats(self):
+        return {
+            "monitor": str(self.monitor or CAPTURE_MONITOR),
+            "region": self.region or CAPTURE_REGION,
+            "sources": dict(self.sources),
+            "last_target": self.last_target,
+            "window_error": self._window_error,
+            "pixels_vs_desktop": round(self.pixels_captured / self.pixels_desktop, 3) if self.pixels_desktop else None,
+            "scale": str(CAPTURE_SCALE if self.scale is None else self.scale),
+            "display_scale": self.last_scale,
+            "pixels_vs_native": round(self.pixels_scaled / self.pixels_native, 3) if self.pixels_native else None,
+            "raw_mb_saved": round((self.bytes_native - self.bytes_scaled) / 1e6, 1),
+        }
+
+
+_CAPTURE_SELECTOR = CaptureSelector()
+
+
+# === Frame encoders ===
+# Encoders take OpenCV-ordered uint8 frames (BGR or BGRA) and return bytes.
+DEFAULT_FRAME_ENCODER = "cv2"
+FRAME_QUALITY = 85
+SCREEN_MAX_FRAME_SIZE = None  # longest side in pixels, None keeps full size
+CAMERA_MAX_FRAME_SIZE = 1024
+
+
+class FrameEncoder:
+    """
+    Base class for frame encoder backends.
+    quality is the codec quality (0-100); max_size caps the longest side
+    of the frame (aspect ratio is kept, like PIL's thumbnail()).
+    """
+
+    name = "base"
+    mime_type = "image/jpeg"
+
+    def __init__(self, quality=FRAME_QUALITY, max_size=None):
+        self.quality = int(quality)
+        self.max_size = max_size
+
+    def _resize(self, frame):
+        height, width = frame.shape[:2]
+        if not self.max_size or max(height, width) <= self.max_size:
+            return frame
+        scale = self.max_size / max(height, width)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def _encode(self, frame):
+        raise NotImplementedError
+
+    def encode(self, frame):
+        """Encode a BGR/BGRA frame and return the compressed bytes."""
+        return self._encode(self._resize(frame))
+
+    def encode_message(self, frame):
+        """Encode a frame into a Live API realtime media message."""
+        return {
+            "mime_type": self.mime_type,
+            "data": base64.b64encode(self.encode(frame)).decode(),
+        }
+
+
+class PILFrameEncoder(FrameEncoder):
+    name = "pil"
+
+    def _encode(self, frame):
+        height, width = frame.shape[:2]
+        raw_mode = "BGRX" if frame.shape[2] == 4 else "BGR"
+        img = Image.frombuffer("RGB", (width, height), np.ascontiguousarray(frame).data,
+                                   "raw", raw_mode, 0, 1)
+        image_io = io.BytesIO()
+        img.save(image_io, format="JPEG", quality=self.quality)
+        return image_io.getvalue()
+
+
+class OpenCVFrameEncoder(FrameEncoder):
+    name = "cv2"
+    extension = ".jpg"
+
+    def _params(self):
+        return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+
+    def _encode(self, frame):
+        if frame.shape[2] == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+        ok, buf = cv2.imencode(self.extension, frame, self._params())
+        if not ok:
+            raise RuntimeError(f"cv2.imencode({self.extension}) failed")
+        return buf.tobytes()
+
+
+class WebPFrameEncoder(OpenCVFrameEncoder):
+    name = "webp"
+    mime_type = "image/webp"
+    extension = ".webp"
+
+    def _params(self):
+        return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+
+
+class TurboJPEGFrameEncoder(FrameEncoder):
+    """libjpeg-turbo via the optional PyTurboJPEG package (pip install PyTurboJPEG)."""
+
+    name = "turbojpeg"
+
+    def __init__(self, quality=FRAME_QUALITY, max_size=None):
+        super().__init__(quality, max_size)
+        import turbojpeg
+        self._turbojpeg = turbojpeg
+        self._jpeg = turbojpeg.TurboJPEG()
+
+    def _encode(self, frame):
+        pixel_format = self._turbojpeg.TJPF_BGRA if frame.shape[2] == 4 else self._turbojpeg.TJPF_BGR
+        return self._jpeg.encode(np.ascontiguousarray(frame), quality=self.quality,
+                                 pixel_format=pixel_format)
+
+
+FRAME_ENCODERS = {
+    "pil": PILFrameEncoder,
+    "cv2": OpenCVFrameEncoder,
+    "turbojpeg": TurboJPEGFrameEncoder,
+    "webp": WebPFrameEncoder,
+}
+
+
+def make_frame_encoder(name=DEFAULT_FRAME_ENCODER, quality=FRAME_QUALITY, max_size=None):
+    """Build a frame encoder by backend name (see FRAME_ENCODERS)."""
+    if name not in FRAME_ENCODERS:
+        raise ValueError(f"Unknown frame encoder '{name}', choose from {sorted(FRAME_ENCODERS)}")
+    return FRAME_ENCODERS[name](quality=quality, max_size=max_size)
+
+
+def synthetic_desktop_frame(width, height, seed=0):
+    """
+    Build a BGRA frame that looks roughly like a desktop: flat background,
+    windows with title bars, rows of glyph-like text, a gradient and a
+    photo-like noisy patch. Used by the offline benchmarks.
+    """
+    rng = np.random.default_rng(seed)
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    frame[:] = (64, 48, 40, 255)
+
+    for _ in range(max(3, (width * height) // 400_000)):
+        ww = int(rng.integers(width // 5, width // 2))
+        wh = int(rng.integers(height // 5, height // 2))
+        x0 = int(rng.integers(0, width - ww))
+        y0 = int(rng.integers(0, height - wh))
+        frame[y0:y0 + wh, x0:x0 + ww] = (245, 245, 245, 255)
+        frame[y0:y0 + 28, x0:x0 + ww] = (210, 210, 210, 255)
+
+        # Lines of "text": short dark runs separated by gaps
+        for ty in range(y0 + 40, y0 + wh - 14, 18):
+            tx = x0 + 12
+            while tx < x0 + ww - 20:
+                glyphs = int(rng.integers(2, 9)) * 7
+                frame[ty:ty + 10, tx:min(tx + glyphs, x0 + ww - 12)] = (30, 30, 30, 255)
+                tx += glyphs + 6
+
+    # Gradient strip (e.g. a wallpaper or a chart)
+    gy = height - height // 6
+    ramp = np.linspace(0, 255, width, dtype=np.uint8)
+    frame[gy:, :, 0] = ramp
+    frame[gy:, :, 1] = ramp[::-1]
+
+    # Photo-like noisy patch
+    ph, pw = height // 4, width // 4
+    frame[:ph, width - pw:, :3] = rng.integers(0, 256, size=(ph, pw, 3), dtype=np.uint8)
+    return frame
+
+
+def benchmark_frame_encoders(resolutions=((1920, 1080), (3840, 2160), (7680, 2160)),
+                             repeats=10, quality=FRAME_QUALITY, max_size=SCREEN_MAX_FRAME_SIZE):
+    """
+    Report encode latency and output size for every available backend on
+    synthetic desktop-like BGRA frames (the format the screen stream uses).
+    """
+    results = []
+    for width, height in resolutions:
+        frames = [synthetic_desktop_frame(width, height, seed=i) for i in range(3)]
+        for name in FRAME_ENCODERS:
+            try:
+                encoder = make_frame_encoder(name, quality=quality, max_size=max_size)
+            except ImportError as e:
+                print(f"[BENCH] {name}: unavailable ({e})")
+                continue
+            encoder.encode(frames[0])  # warm-up
+
+            timings, sizes = [], []
+            for i in range(repeats):
+                start = time.perf_counter()
+                data = encoder.encode(frames[i % len(frames)])
+                timings.append((time.perf_counter() - start) * 1000)
+                sizes.append(len(data))
+            timings.sort()
+            result = {
+                "encoder": name,
+                "resolution": f"{width}x{height}",
+                "p50_ms": round(timings[len(timings) // 2], 2),
+                "max_ms": round(timings[-1], 2),
+                "mean_kb": round(sum(sizes) / len(sizes) / 1024, 1),
+                "base64_kb": round(sum(sizes) / len(sizes) * 4 / 3 / 1024, 1),
+            }
+            results.append(result)
+            print(f"[BENCH] {result['resolution']:>10} {name:>10}: "
+                  f"p50 {result['p50_ms']:8.2f} ms  max {result['max_ms']:8.2f} ms  "
+                  f"{result['mean_kb']:8.1f} KiB ({result['base64_kb']:.1f} KiB base64)")
+    return results
+
+
+def benchmark_capture_scale(encoder=DEFAULT_FRAME_ENCODER, quality=FRAME_QUALITY, repeats=5):
+    """
+    Grab the selected capture region natively and at CAPTURE_SCALE, then
+    report pixels, stream-encoded bytes and vision JPEG bytes for both
+    (needs a real display).
+    """
+    engine = get_capture_engine()
+    stream = make_frame_encoder(encoder, quality=quality)
+    results = []
+    for scale in ("native", CAPTURE_SCALE):
+        selector = CaptureSelector(scale=scale)
+        stream_sizes, jpeg_sizes, timings = [], [], []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            frame, region = selector.grab_bgr(engine)
+            timings.append((time.perf_counter() - start) * 1000)
+            stream_sizes.append(len(stream.encode(frame)))
+            jpeg_sizes.append(len(encode_jpeg(frame)))
+        timings.sort()
+        result = {
+            "scale": scale,
+            "region": repr(region),
+            "pixels": frame.shape[0] * frame.shape[1],
+            "capture_p50_ms": round(timings[len(timings) // 2], 2),
+            "stream_kb": round(sum(stream_sizes) / len(stream_sizes) / 1024, 1),
+            "vision_jpeg_kb": round(sum(jpeg_sizes) / len(jpeg_sizes) / 1024, 1),
+        }
+        results.append(result)
+        print(f"[BENCH] {scale:>8}: {frame.shape[1]}x{frame.shape[0]} ({result['pixels'] / 1e6:.2f} MP)  "
+              f"capture p50 {result['capture_p50_ms']:.2f} ms  {encoder} {result['stream_kb']:.1f} KiB  "
+              f"vision JPEG {result['vision_jpeg_kb']:.1f} KiB")
+    native, scaled = results
+    print(f"[BENCH] {CAPTURE_SCALE} vs native: {scaled['pixels'] / native['pixels']:.0%} of the pixels, "
+          f"{scaled['stream_kb'] / max(native['stream_kb'], 0.1):.0%} of the stream bytes, "
+          f"{scaled['vision_jpeg_kb'] / max(native['vision_jpeg_kb'], 0.1):.0%} of the vision JPEG bytes")
+    return results
+
+
+# === Screenshot archiving ===
+# Screenshots sent to the vision tools stay in memory; writing them to disk
+# is opt-in (--archive-screens) and happens on a background thread.
+ARCHIVE_SCREENSHOTS = False
+ARCHIVE_QUEUE_SIZE = 8
+# cv2.imwrite's default JPEG quality, kept for the vision tool uploads
+VISION_JPEG_QUALITY = 95
+
+
+class ScreenshotArchiver:
+    """
+    Writes already-encoded screenshots to disk on a daemon thread.
+    archive() never blocks: when the bounded queue is full the batch is
+    dropped and counted instead.
+    """
+
+    def __init__(self, maxsize=ARCHIVE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="screenshot-archiver", daemon=True)
+                self._thread.start()
+
+    def archive(self, save_dir, files):
+        """Queue {filename: bytes} to be written under save_dir. Returns False if dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((save_dir, files))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _worker(self):
+        while True:
+            save_dir, files = self._queue.get()
+            try:
+                os.makedirs(save_dir, exist_ok=True)
+                for name, data in files.items():
+                    with open(os.path.join(save_dir, name), "wb") as f:
+                        f.write(data)
+                self.written += 1
+            except OSError as e:
+                self.failed += 1
+                print(f"[ERROR] Failed to archive screenshots in {save_dir}: {e}")
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+        }
+
+
+_SCREENSHOT_ARCHIVER = ScreenshotArchiver()
+
+
+def archive_screenshots(save_dir, files):
+    """Archive encoded screenshots if ARCHIVE_SCREENSHOTS is on; returns the directory or None."""
+    if not ARCHIVE_SCREENSHOTS:
+        return None
+    return save_dir if _SCREENSHOT_ARCHIVER.archive(save_dir, files) else None
+
+
+def encode_jpeg(img, quality=VISION_JPEG_QUALITY):
+    """Encode a BGR image to JPEG bytes in memory."""
+    return make_frame_encoder("cv2", quality=quality).encode(img)
 
 
 def show_quiz_modal(quiz_text):
@@ -174,48 +1084,34 @@ def show_quiz_modal(quiz_text):
     root.mainloop()
 
 
-def generate_quiz_from_screen():
+def _capture_quiz_image():
+    """Grab the selected capture region and JPEG-encode it (runs in a worker thread)."""
+    return encode_jpeg(_CAPTURE_SELECTOR.grab_bgr()[0])
+
+
+async def generate_quiz_from_screen():
     """
     Capture the current screen and generate a fun quiz with:
     - 2 questions about what's visible on screen
     - 1 fun/creative question for entertainment
 
-    Displays in a translucent modal window if on main thread,
-    otherwise prints to console (safe for async/threaded contexts).
+    Runs inside the event loop using the shared async client, so the quiz
+    is printed to the console; show_quiz_modal() would block the loop.
     """
-    import inspect
-
     try:
         print("[LOG] Starting quiz generation...")
 
-        # Capture screen
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            img = np.array(sct.grab(monitor))
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-
-            # Save screenshot
-            save_dir = f"quiz_screens_{int(time.time())}"
-            os.makedirs(save_dir, exist_ok=True)
-            screenshot_path = f"{save_dir}/screen.jpg"
-            cv2.imwrite(screenshot_path, img)
+        # Capture and encode in memory, off the event loop
+        image_bytes = await asyncio.to_thread(_capture_quiz_image)
 
-        print(f"[LOG] Screenshot saved at: {screenshot_path}")
+        screenshot_path = archive_screenshots(f"quiz_screens_{int(time.time())}",
+                                              {"screen.jpg": image_bytes})
+        if screenshot_path:
+            print(f"[LOG] Screenshot archived to: {screenshot_path}/screen.jpg")
 
-        # Read image for Gemini
-        with open(screenshot_path, "rb") as f:
-            image_bytes = f.read()
-
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("Missing GOOGLE_API_KEY environment variable.")
-
-        print("[LOG] Connecting to Gemini API...")
-        quiz_client = genai.Client(api_key=api_key)
-
-        # Generate quiz using Gemini
-        response = quiz_client.models.generate_content(
-            model="models/gemini-2.5-pro",
+        # Generate quiz using Gemini (shared pooled async client)
+        response = await get_client().aio.models.generate_content(
+            model=VISION_MODEL,
             contents=[
                 types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"),
                 types.Part.from_text(
@@ -244,211 +1140,870 @@ Make the questions engaging and fun!"""
         print(quiz_text)
         print("=" * 60 + "\n")
 
-        # Only show GUI if on main thread
-        if threading.current_thread() is threading.main_thread():
-            print("[LOG] On main thread — showing Tkinter modal.")
-            show_quiz_modal(quiz_text)
-        else:
-            print("[LOG] Not on main thread — skipping GUI, printing to console only.")
+        print("[LOG] Running in the event loop — skipping GUI, printing to console only.")
 
-        return {
+        result = {
             "result": "Quiz generated successfully!",
             "quiz": quiz_text,
-            "screenshot": screenshot_path
         }
+        if screenshot_path:
+            result["screenshot"] = f"{screenshot_path}/screen.jpg"
+        return result
 
     except Exception as e:
-        import traceback
         print("[ERROR] Quiz generation failed:", e)
         print(traceback.format_exc())
         return {"error": f"Failed to generate quiz: {str(e)}"}
 
-def smart_detect_screen_coordinates(prompt):
-    """
-    Capture the screen, draw a grid with numbered coordinates,
-    save three images:
-      1️⃣ Original screen (no grid)
-      2️⃣ Screen with grid overlay
-      3️⃣ Pure grid only (no background)
-    Send both the grid and original to Gemini 2.5 Pro,
-    and return (x, y) coordinates.
-    """
-    import os
-    import time
-    import cv2
-    import numpy as np
-    # from mss import mss
-    from google import genai
-    from google.genai import types
-
-    # === Setup ===
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("Missing GOOGLE_API_KEY environment variable.")
+# === Grid overlay cache ===
+GRID_STEP = 25
+GRID_LINE_COLOR = (90, 90, 90)
+GRID_LABEL_COLOR = (255, 255, 255)
+# Send only the gridded screenshot instead of original + grid + pure grid
+GRID_SEND_SINGLE_IMAGE = False
+
 
-    client = genai.Client(api_key=api_key)
-    save_dir = f"screens_{int(time.time())}"
-    os.makedirs(save_dir, exist_ok=True)
-    step = 25
+class GridOverlay:
+    """
+    Grid lines and coordinate labels for one (width, height, step),
+    rendered once into a BGR overlay plus a boolean mask of the pixels it
+    covers. Compositing is then a single masked numpy copy.
+    """
 
-    original_path = f"{save_dir}/screen.jpg"
-    grid_path = f"{save_dir}/screen_grid.jpg"
-    pure_grid_path = f"{save_dir}/grid_only.jpg"
+    def __init__(self, width, height, step=GRID_STEP, line_color=GRID_LINE_COLOR,
+                 label_color=GRID_LABEL_COLOR):
+        self.width = width
+        self.height = height
+        self.step = step
 
-    # === Capture Screen ===
-    with mss.mss() as sct:
-        monitor = sct.monitors[1]  # Full primary screen
-        img = np.array(sct.grab(monitor))
-        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        cv2.imwrite(original_path, img)
-
-    # === Draw Grid Overlay ===
-    grid_img = img.copy()
-    height, width, _ = grid_img.shape
-
-    def draw_grid(base_img, color=(90, 90, 90)):
-        """Draws grid lines and coordinate labels."""
+        line_mask = np.zeros((height, width), dtype=np.uint8)
+        label_mask = np.zeros((height, width), dtype=np.uint8)
         for x in range(0, width, step):
-            cv2.line(base_img, (x, 0), (x, height), color, 1)
-            cv2.putText(base_img, str(x), (x + 2, 15),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-            cv2.putText(base_img, str(x), (x + 2, height - 5),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            cv2.line(line_mask, (x, 0), (x, height), 255, 1)
+            cv2.putText(label_mask, str(x), (x + 2, 15),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, 255, 1)
+            cv2.putText(label_mask, str(x), (x + 2, height - 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, 255, 1)
         for y in range(0, height, step):
-            cv2.line(base_img, (0, y), (width, y), color, 1)
-            cv2.putText(base_img, str(y), (5, y + 12),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-            cv2.putText(base_img, str(y), (width - 40, y + 12),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-        return base_img
-
-    # Apply to overlay image
-    grid_img = draw_grid(grid_img)
-    cv2.imwrite(grid_path, grid_img)
-
-    # === Pure Grid Only (white background) ===
-    pure_grid = np.ones_like(img, dtype=np.uint8) * 255
-    pure_grid = draw_grid(pure_grid, color=(0, 0, 0))
-    cv2.imwrite(pure_grid_path, pure_grid)
-
-    print(f"📸 Saved images:\n  • Original: {original_path}\n  • Grid: {grid_path}\n  • Pure grid: {pure_grid_path}")
-
-    # === Send to Gemini ===
-    with open(original_path, "rb") as f1, open(grid_path, "rb") as f2, open(pure_grid_path, "rb") as f3:
-        original_bytes = f1.read()
-        grid_bytes = f2.read()
-        pure_grid_bytes = f3.read()
-
-    # ✅ Use correct Part syntax for SDK >=0.6
-    response = client.models.generate_content(
-        model="models/gemini-2.5-pro",
-        contents=[
-            types.Part.from_bytes(data=original_bytes, mime_type="image/jpeg"),
-            types.Part.from_bytes(data=grid_bytes, mime_type="image/jpeg"),
-            types.Part.from_bytes(data=pure_grid_bytes, mime_type="image/jpeg"),
-            types.Part.from_text(
-                text=f"Find the coordinates of the object '{prompt}' using the grid reference. "
-                     f"Use the pure grid for scale and precision. Return only the coordinates in format x=___, y=___."
-            )
-        ]
-    )
+            cv2.line(line_mask, (0, y), (width, y), 255, 1)
+            cv2.putText(label_mask, str(y), (5, y + 12),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, 255, 1)
+            cv2.putText(label_mask, str(y), (width - 40, y + 12),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, 255, 1)
+        line_mask = line_mask.astype(bool)
+        label_mask = label_mask.astype(bool)
+
+        # Labels are drawn after lines, so they win where both overlap
+        self.overlay = np.zeros((height, width, 3), dtype=np.uint8)
+        self.overlay[line_mask] = line_color
+        self.overlay[label_mask] = label_color
+        self.mask = (line_mask | label_mask)[..., None]
+
+        # Pure grid reference: black grid and labels on white
+        self.pure_grid = np.full((height, width, 3), 255, dtype=np.uint8)
+        self.pure_grid[line_mask | label_mask] = 0
+        self._pure_grid_jpeg = None
+
+    def pure_grid_jpeg(self):
+        """JPEG bytes of the pure grid, encoded on first use."""
+        if self._pure_grid_jpeg is None:
+            self._pure_grid_jpeg = encode_jpeg(self.pure_grid)
+        return self._pure_grid_jpeg
+
+    def composite(self, img, out=None):
+        """Return img with the grid blended in (into out if given, else a new array)."""
+        if out is None:
+            out = img.copy()
+        elif out is not img:
+            np.copyto(out, img)
+        np.copyto(out, self.overlay, where=self.mask)
+        return out
+
+
+# Full-resolution overlays are large (~58 MB at 4K), and the key only changes
+# with the screen size; 2 also fits the coarse + fine pair of hierarchical mode.
+GRID_OVERLAY_CACHE_SIZE = 2
+
+
+@functools.lru_cache(maxsize=GRID_OVERLAY_CACHE_SIZE)
+def get_grid_overlay(width, height, step=GRID_STEP):
+    """Cached GridOverlay for a resolution/step pair."""
+    return GridOverlay(width, height, step)
+
+
+# === Coordinate detection cache ===
+DETECTION_CACHE_SIZE = 64
+DETECTION_CACHE_TTL = 120.0           # seconds
+DETECTION_HASH_MAX_DISTANCE = 6       # Hamming distance (out of 64 bits) that still counts as "same screen"
+DETECTION_REGION_RADIUS = 64          # pixels around a previous hit that must be unchanged
+
+COORDINATE_PATTERN = re.compile(r"x\s*[=:]\s*(-?\d+(?:\.\d+)?)\s*,?\s*y\s*[=:]\s*(-?\d+(?:\.\d+)?)",
+                                re.IGNORECASE)
+
+
+def parse_coordinates(text):
+    """Extract (x, y) from model output like 'x=123, y=456'; None if absent."""
+    match = COORDINATE_PATTERN.search(text or "")
+    if not match:
+        return None
+    return int(round(float(match.group(1)))), int(round(float(match.group(2))))
+
+
+def perceptual_hash(img):
+    """64-bit DCT perceptual hash of a BGR/BGRA/gray image."""
+    if img.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        img = cv2.cvtColor(img, code)
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class DetectionCache:
+    """
+    LRU cache of coordinate detection results.
+
+    Entries are keyed by (normalized prompt, perceptual hash of the screen,
+    capture region). Cached coordinates are in the captured image's pixels,
+    so an entry only matches captures of the same region at the same scale.
+    A lookup only hits when the region around the cached point still hashes
+    within max_distance bits of what it was: a 64-bit hash of the whole
+    screen cannot see a button move or disappear, so it is only used to try
+    the closest-looking entries first. Unrelated changes elsewhere on
+    screen therefore don't invalidate an entry (counted as region_hits).
+    Entries expire after ttl seconds; the oldest are evicted past max_entries.
+    """
 
-    text = response.text.strip()
-    print("🔍 Model output:", text)
-    return {"result": text}
+    def __init__(self, max_entries=DETECTION_CACHE_SIZE, ttl=DETECTION_CACHE_TTL,
+                 max_distance=DETECTION_HASH_MAX_DISTANCE, region_radius=DETECTION_REGION_RADIUS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.region_radius = region_radius
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.region_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize_prompt(prompt):
+        return " ".join(str(prompt).lower().split()).strip(" .!?'\"")
+
+    @staticmethod
+    def region_key(region):
+        """Hashable (left, top, width, height, scale) of a CaptureRegion, or None."""
+        if region is None:
+            return None
+        return region.left, region.top, region.width, region.height, round(region.scale, 4)
+
+    def _region_hash(self, img, coords):
+        x, y = coords
+        height, width = img.shape[:2]
+        r = self.region_radius
+        x0, x1 = max(0, x - r), min(width, x + r)
+        y0, y1 = max(0, y - r), min(height, y + r)
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+        return perceptual_hash(img[y0:y1, x0:x1])
+
+    def _purge_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        self.expirations += len(expired)
+
+    def lookup(self, prompt, img, screen_hash=None, region=None):
+        """Return the cached result dict for prompt on this screen (and capture region), or None."""
+        prompt = self.normalize_prompt(prompt)
+        region = self.region_key(region)
+        if screen_hash is None:
+            screen_hash = perceptual_hash(img)
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            # Most similar screens first (most recent first among equals)
+            candidates = sorted((key for key in reversed(self._entries) if key[0] == prompt and key[2] == region),
+                                key=lambda key: (key[1] ^ screen_hash).bit_count())
+            for key in candidates:
+                entry = self._entries[key]
+                region_hash = entry["region_hash"]
+                current = self._region_hash(img, entry["coords"]) if region_hash is not None else None
+                if current is None or (current ^ region_hash).bit_count() > self.max_distance:
+                    continue
+                self.hits += 1
+                if (key[1] ^ screen_hash).bit_count() > self.max_distance:
+                    self.region_hits += 1
+                self._entries.move_to_end(key)
+                return entry["result"]
+            self.misses += 1
+            return None
 
-def get_screen_size():
-    """Get the screen size."""
-    return {"width": pyautogui.size()[0], "height": pyautogui.size()[1]}
+    def store(self, prompt, img, result, coords, screen_hash=None, region=None):
+        if screen_hash is None:
+            screen_hash = perceptual_hash(img)
+        entry = {
+            "result": result,
+            "coords": coords,
+            "region_hash": self._region_hash(img, coords),
+            "created": time.monotonic(),
+        }
+        with self._lock:
+            key = (self.normalize_prompt(prompt), screen_hash, self.region_key(region))
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "region_hits": self.region_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
 
-def get_mouse_position():
-    """Get the mouse position."""
-    return {"x": _MOUSE_CONTROLLER.position[0], "y": _MOUSE_CONTROLLER.position[1]}
 
-def move_mouse_relative(x: int, y: int):
-    """Move the mouse relative to the current position. x is the horizontal distance to move and y is the vertical distance to move.
-    x is the distance from the left edge of the screen and y is the distance from the top edge of the screen.
-    So get the current mouse position first, then add the x and y to the current position.
-    """
-    current_x, current_y = _MOUSE_CONTROLLER.position
-    _MOUSE_CONTROLLER.position = (int(current_x + x), int(current_y + y))
-    return {"result": f"mouse current position is {_MOUSE_CONTROLLER.position}"}
-def move_mouse_absolute(x, y):
-    import time
-    start_x, start_y = _MOUSE_CONTROLLER.position
-    steps = 20
-    delay = 0.005
-    for i in range(1, steps + 1):
-        nx = int(start_x + (x - start_x) * i / steps)
-        ny = int(start_y + (y - start_y) * i / steps)
-        _MOUSE_CONTROLLER.position = (nx, ny)
-        time.sleep(delay)
-    return {"result": f"Mouse moved smoothly to {(x, y)}"}
-    
-def left_click_mouse(count: int = 1):
-    """Left click the mouse button once."""
-    _MOUSE_CONTROLLER.click(mouse.Button.left, count)
-    return {"result": f"left clicked the mouse button {count} times"}
+_DETECTION_CACHE = DetectionCache()
 
-def right_click_mouse(count: int = 1):
-    """Right click the mouse button once."""
-    _MOUSE_CONTROLLER.click(mouse.Button.right, count)
-    return {"result": f"right clicked the mouse button {count} times"}
 
-def scroll_mouse_by(dx: int, dy: int):
-    """
-    Scroll the mouse by the given amounts.
-    dx: horizontal scroll steps (positive -> right)
-    dy: vertical scroll steps (positive -> up)
-    Uses pynput.mouse.Controller.scroll(dx, dy).
-    """
-    mouse.Controller().scroll(dx, dy)
-    return {"result": f"scrolled by dx={dx}, dy={dy}"}
+# === Coordinate detection ===
+VISION_MODEL = "models/gemini-2.5-pro"
+# "single": one full-resolution gridded request (default)
+# "hierarchical": a downscaled coarse pass, then a fine grid on a crop of that region
+DETECTION_MODE = "single"
+DETECTION_MODES = ("single", "hierarchical")
+COARSE_MAX_SIZE = 1024        # longest side of the stage-1 frame
+COARSE_GRID_STEP = 50         # grid step on the stage-1 frame (downscaled pixels)
+FINE_REGION_SIZE = 320        # side of the stage-2 crop (screen pixels)
+FINE_ZOOM = 2                 # stage-2 crop is upscaled by this factor before gridding
+FINE_GRID_STEP = 25           # grid step on the upscaled crop
 
 
-def press_key(key: str):
-    """Press the given key. key is the key to press. key is a string of the key to press.
-    """
-    special_keys = {
-        "space": keyboard.Key.space,
-        "enter": keyboard.Key.enter,
-        "shift": keyboard.Key.shift,
-        "ctrl": keyboard.Key.ctrl,
-        "alt": keyboard.Key.alt,
-        "cmd": keyboard.Key.cmd,
-        "tab": keyboard.Key.tab,
-        "esc": keyboard.Key.esc,
-        "up": keyboard.Key.up,
-        "down": keyboard.Key.down,
-        "left": keyboard.Key.left,
-        "right": keyboard.Key.right,
-        "backspace": keyboard.Key.backspace,
-        "delete": keyboard.Key.delete,
+async def _request_coordinates(client, images, instructions):
+    """Send JPEG images + instructions to the vision model and return its text."""
+    response = await client.aio.models.generate_content(
+        model=VISION_MODEL,
+        contents=[types.Part.from_bytes(data=data, mime_type="image/jpeg") for data in images]
+        + [types.Part.from_text(text=instructions)]
+    )
+    return response.text.strip()
+
+
+def _prepare_single_shot(img, prompt, single_image):
+    """Grid + encode the single-shot request images (CPU work, run in a thread)."""
+    height, width, _ = img.shape
+    grid = get_grid_overlay(width, height, GRID_STEP)
+    grid_bytes = encode_jpeg(grid.composite(img))
+    if single_image:
+        images = {"screen_grid.jpg": grid_bytes}
+        instructions = (f"Find the coordinates of the object '{prompt}' using the grid reference "
+                        f"(lines every {GRID_STEP}px, labelled in pixels). "
+                        f"Return only the coordinates in format x=___, y=___.")
+    else:
+        # The pure grid is encoded once per cached overlay
+        images = {
+            "screen.jpg": encode_jpeg(img),
+            "screen_grid.jpg": grid_bytes,
+            "grid_only.jpg": grid.pure_grid_jpeg(),
+        }
+        instructions = (f"Find the coordinates of the object '{prompt}' using the grid reference. "
+                        f"Use the pure grid for scale and precision. Return only the coordinates in format x=___, y=___.")
+    return images, instructions
+
+
+async def _detect_single_shot(client, img, prompt, single_image):
+    """Full-resolution detection with the cached 25px grid (the original method)."""
+    images, instructions = await asyncio.to_thread(_prepare_single_shot, img, prompt, single_image)
+    text = await _request_coordinates(client, images.values(), instructions)
+    return {
+        "result": text,
+        "coords": parse_coordinates(text),
+        "images": images,
+        "bytes_sent": sum(len(data) for data in images.values()) + len(instructions),
     }
-    if key in special_keys:
-        keyboard.Controller().press(special_keys[key])
+
+
+def _prepare_coarse(img):
+    """Downscale + grid + encode the stage-1 frame. Returns (jpeg bytes, scale)."""
+    height, width, _ = img.shape
+    scale = min(1.0, COARSE_MAX_SIZE / max(height, width))
+    if scale < 1.0:
+        small = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
     else:
-        keyboard.Controller().press(key)
-    return {"result": f"pressed the key {key}"}
+        small = img
+    grid = get_grid_overlay(small.shape[1], small.shape[0], COARSE_GRID_STEP)
+    return encode_jpeg(grid.composite(small)), scale
+
+
+def _prepare_fine(img, cx, cy):
+    """Crop around (cx, cy), upscale and grid it. Returns (jpeg bytes, x0, y0)."""
+    height, width, _ = img.shape
+    region = min(FINE_REGION_SIZE, width, height)
+    x0 = int(min(max(0, cx - region / 2), width - region))
+    y0 = int(min(max(0, cy - region / 2), height - region))
+    crop = img[y0:y0 + region, x0:x0 + region]
+    patch = cv2.resize(crop, (region * FINE_ZOOM, region * FINE_ZOOM), interpolation=cv2.INTER_CUBIC)
+    grid = get_grid_overlay(patch.shape[1], patch.shape[0], FINE_GRID_STEP)
+    return encode_jpeg(grid.composite(patch)), x0, y0
+
+
+async def _detect_hierarchical(client, img, prompt):
+    """
+    Two-stage detection: pick a coarse region on a downscaled frame, then
+    refine on a gridded, upscaled crop of that region. Coordinates from
+    both stages are mapped back to screen pixels here.
+    """
+    height, width, _ = img.shape
+
+    # === Stage 1: coarse region on a downscaled frame ===
+    coarse_bytes, scale = await asyncio.to_thread(_prepare_coarse, img)
+    coarse_instructions = (f"Find the approximate center of '{prompt}' in this screenshot. "
+                           f"Grid lines are every {COARSE_GRID_STEP}px and labelled in pixels. "
+                           f"Return only the coordinates in format x=___, y=___.")
+    coarse_text = await _request_coordinates(client, [coarse_bytes], coarse_instructions)
+    images = {"coarse_grid.jpg": coarse_bytes}
+    bytes_sent = len(coarse_bytes) + len(coarse_instructions)
+
+    coarse_xy = parse_coordinates(coarse_text)
+    if coarse_xy is None:
+        return {"result": coarse_text, "coords": None, "images": images, "bytes_sent": bytes_sent}
+    cx = min(width - 1, max(0, coarse_xy[0] / scale))
+    cy = min(height - 1, max(0, coarse_xy[1] / scale))
+
+    # === Stage 2: fine grid on a crop around the coarse hit ===
+    fine_bytes, x0, y0 = await asyncio.to_thread(_prepare_fine, img, cx, cy)
+    fine_instructions = (f"This is a zoomed-in crop of a screenshot. Find the exact center of '{prompt}' "
+                         f"using the grid (lines every {FINE_GRID_STEP}px, labelled in pixels of this image). "
+                         f"Return only the coordinates in format x=___, y=___.")
+    fine_text = await _request_coordinates(client, [fine_bytes], fine_instructions)
+    images["fine_grid.jpg"] = fine_bytes
+    bytes_sent += len(fine_bytes) + len(fine_instructions)
+
+    fine_xy = parse_coordinates(fine_text)
+    if fine_xy is None:
+        # Refinement failed; fall back to the coarse estimate
+        x, y = cx, cy
+    else:
+        x = x0 + fine_xy[0] / FINE_ZOOM
+        y = y0 + fine_xy[1] / FINE_ZOOM
+    x = int(round(min(width - 1, max(0, x))))
+    y = int(round(min(height - 1, max(0, y))))
+    return {"result": f"x={x}, y={y}", "coords": (x, y), "images": images, "bytes_sent": bytes_sent}
+
+
+async def detect_coordinates(client, img, prompt, mode=None, single_image=None):
+    """Run coordinate detection on a BGR image with the given mode (see DETECTION_MODES)."""
+    mode = mode or DETECTION_MODE
+    if single_image is None:
+        single_image = GRID_SEND_SINGLE_IMAGE
+    if mode == "hierarchical":
+        return await _detect_hierarchical(client, img, prompt)
+    if mode == "single":
+        return await _detect_single_shot(client, img, prompt, single_image)
+    raise ValueError(f"Unknown detection mode '{mode}', choose from {DETECTION_MODES}")
+
+
+def _capture_for_detection():
+    """
+    Grab the selected capture region into an owned BGR array and hash it
+    (runs in a thread). Returns (image, hash, CaptureRegion).
+    """
+    img, region = _CAPTURE_SELECTOR.grab_bgr(reuse_buffer=False)
+    return img, perceptual_hash(img), region
+
+
+def _global_detection_result(result, region):
+    """Map a detection result from image coordinates to global screen coordinates."""
+    coords = parse_coordinates(result.get("result"))
+    if coords is None:
+        return result
+    x, y = region.to_global(*coords)
+    _CAPTURE_SELECTOR.set_target(x, y)
+    return dict(result, result=f"x={x}, y={y}")
+
+
+async def smart_detect_screen_coordinates(prompt, single_image=None, use_cache=True, mode=None):
+    """
+    Capture the screen, draw a grid with numbered coordinates,
+    encode three images in memory:
+      1️⃣ Original screen (no grid)
+      2️⃣ Screen with grid overlay
+      3️⃣ Pure grid only (no background)
+    Send them to Gemini 2.5 Pro, and return (x, y) coordinates in global
+    screen space (the capture region comes from _CAPTURE_SELECTOR).
+    Images are only written to disk when ARCHIVE_SCREENSHOTS is on.
+    With single_image (default GRID_SEND_SINGLE_IMAGE) only the gridded
+    screen is sent, which cuts upload size and model latency.
+    mode="hierarchical" (default DETECTION_MODE) uses the coarse-to-fine
+    two-stage method instead.
+    Results are cached per (prompt, screen perceptual hash, capture region); pass
+    use_cache=False to force a fresh detection.
+    Uses the shared async client, so no new connection per call.
+    """
+    # === Capture Screen ===
+    img, screen_hash, region = await asyncio.to_thread(_capture_for_detection)
+
+    # === Cache lookup ===
+    # Cached results are in image coordinates; map them for the current region
+    if use_cache:
+        cached = _DETECTION_CACHE.lookup(prompt, img, screen_hash, region)
+        if cached is not None:
+            print("⚡ Detection cache hit:", cached["result"])
+            return _global_detection_result(dict(cached, cached=True), region)
+
+    # === Detect ===
+    detection = await detect_coordinates(get_client(), img, prompt, mode=mode, single_image=single_image)
+
+    save_dir = archive_screenshots(f"screens_{int(time.time())}", detection["images"])
+    if save_dir:
+        print(f"📸 Archiving images to {save_dir}: {', '.join(detection['images'])}")
+
+    text = detection["result"]
+    print("🔍 Model output:", text)
+    result = {"result": text}
+
+    if detection["coords"] is not None:
+        _DETECTION_CACHE.store(prompt, img, result, detection["coords"], screen_hash, region)
+    return _global_detection_result(result, region)
+
+
+async def benchmark_detection(manifest_path, modes=DETECTION_MODES, tolerance=15):
+    """
+    Compare detection modes on recorded screenshots.
+
+    manifest_path is a JSON list of {"image": path, "prompt": str, "x": int, "y": int}
+    (image paths relative to the manifest). Reports bytes sent, latency and
+    distance to the labelled target for each mode. Makes real API calls.
+    """
+    client = get_client()
+    with open(manifest_path) as f:
+        cases = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    summary = {}
+    for mode in modes:
+        latencies, sizes, errors, found = [], [], [], 0
+        for case in cases:
+            img = cv2.imread(os.path.join(base_dir, case["image"]), cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"[BENCH] Could not read {case['image']}, skipping")
+                continue
+            start = time.perf_counter()
+            try:
+                detection = await detect_coordinates(client, img, case["prompt"], mode=mode)
+            except Exception as e:
+                print(f"[BENCH] {mode} failed on {case['image']}: {e}")
+                continue
+            latencies.append(time.perf_counter() - start)
+            sizes.append(detection["bytes_sent"])
+            if detection["coords"] is not None:
+                dx = detection["coords"][0] - case["x"]
+                dy = detection["coords"][1] - case["y"]
+                error = (dx * dx + dy * dy) ** 0.5
+                errors.append(error)
+                found += error <= tolerance
+            print(f"[BENCH] {mode:>12} {case['prompt'][:30]:<30} -> {detection['coords']} "
+                  f"(target {case['x']},{case['y']}) {latencies[-1]:.2f}s {sizes[-1] / 1024:.0f} KiB")
+
+        runs = len(latencies)
+        summary[mode] = {
+            "cases": runs,
+            "mean_latency_s": round(sum(latencies) / runs, 2) if runs else None,
+            "mean_kib_sent": round(sum(sizes) / runs / 1024, 1) if runs else None,
+            "mean_error_px": round(sum(errors) / len(errors), 1) if errors else None,
+            f"within_{tolerance}px": f"{found}/{runs}",
+        }
+        print(f"[BENCH] {mode}: {summary[mode]}")
+    return summary
+
+# === Mouse motion engine ===
+MOUSE_MOTION_MODES = ("instant", "linear", "eased")
+MOUSE_MOTION_MODE = "eased"
+MOUSE_MOTION_SPEED = 6000.0  # px/s
+MOUSE_MOTION_MIN_DURATION = 0.02
+MOUSE_MOTION_MAX_DURATION = 0.25
+MOUSE_MOTION_FRAME_INTERVAL = 1 / 120
+SCROLL_STEP_INTERVAL = 0.01
+DEFAULT_HOLD_SECONDS = 0.5
+MAX_HOLD_SECONDS = 10.0
+
+
+def ease_in_out_cubic(p):
+    if p < 0.5:
+        return 4 * p * p * p
+    return 1 - (-2 * p + 2) ** 3 / 2
+
+
+class MouseMotionEngine:
+    """
+    Time-based mouse motion on a shared pynput controller.
+
+    Motion duration grows with distance (MOUSE_MOTION_SPEED px/s, clamped to
+    MIN/MAX_DURATION) and each frame places the cursor where it should be at
+    that moment, so slow frames never stretch the move. Sync moves (tools run
+    on the thread pool) stop when cancel() is called; async moves, drags and
+    holds are cancelled like any other task and always release the button.
+    """
+
+    def __init__(self, controller, mode=None):
+        self.controller = controller
+        self.mode = mode
+        self.generation = 0
+        self.durations = LatencyStats()
+        self.moves = 0
+        self.cancelled = 0
+        self.distance_px = 0.0
+
+    def current_mode(self, mode=None):
+        mode = mode or self.mode or MOUSE_MOTION_MODE
+        if mode not in MOUSE_MOTION_MODES:
+            raise ValueError(f"Unknown mouse motion mode '{mode}', expected one of {MOUSE_MOTION_MODES}")
+        return mode
+
+    def duration_for(self, distance, mode):
+        if mode == "instant" or distance < 1:
+            return 0.0
+        return min(max(distance / MOUSE_MOTION_SPEED, MOUSE_MOTION_MIN_DURATION), MOUSE_MOTION_MAX_DURATION)
+
+    def _plan(self, x, y, mode):
+        start = self.controller.position
+        target = (int(x), int(y))
+        distance = ((target[0] - start[0]) ** 2 + (target[1] - start[1]) ** 2) ** 0.5
+        self.moves += 1
+        self.distance_px += distance
+        return start, target, self.duration_for(distance, mode)
+
+    def _position_at(self, start, target, progress, mode):
+        if mode == "eased":
+            progress = ease_in_out_cubic(progress)
+        return (int(round(start[0] + (target[0] - start[0]) * progress)),
+                int(round(start[1] + (target[1] - start[1]) * progress)))
+
+    def cancel(self):
+        """Stop any sync move in progress (async moves are cancelled via their task)."""
+        self.generation += 1
+
+    def move_to(self, x, y, mode=None):
+        """Blocking move for thread-pool tools. Returns False if cancelled."""
+        mode = self.current_mode(mode)
+        generation = self.generation
+        start, target, duration = self._plan(x, y, mode)
+        started = time.perf_counter()
+        if duration > 0:
+            while True:
+                elapsed = time.perf_counter() - started
+                if elapsed >= duration:
+                    break
+                if self.generation != generation:
+                    self.cancelled += 1
+                    return False
+                self.controller.position = self._position_at(start, target, elapsed / duration, mode)
+                time.sleep(min(MOUSE_MOTION_FRAME_INTERVAL, duration - elapsed))
+        self.controller.position = target
+        self.durations.add(time.perf_counter() - started)
+        return True
+
+    async def move_to_async(self, x, y, mode=None):
+        """Same motion without blocking the event loop; cancel the task to stop it."""
+        mode = self.current_mode(mode)
+        start, target, duration = self._plan(x, y, mode)
+        started = time.perf_counter()
+        try:
+            if duration > 0:
+                while True:
+                    elapsed = time.perf_counter() - started
+                    if elapsed >= duration:
+                        break
+                    self.controller.position = self._position_at(start, target, elapsed / duration, mode)
+                    await asyncio.sleep(min(MOUSE_MOTION_FRAME_INTERVAL, duration - elapsed))
+            self.controller.position = target
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.durations.add(time.perf_counter() - started)
+
+    def move_by(self, dx, dy, mode=None):
+        x, y = self.controller.position
+        return self.move_to(x + dx, y + dy, mode)
+
+    def scroll(self, dx, dy, mode=None):
+        """Scroll in one call (instant) or one notch at a time. Returns False if cancelled."""
+        dx, dy = int(dx), int(dy)
+        steps = max(abs(dx), abs(dy))
+        if self.current_mode(mode) == "instant" or steps <= 1:
+            self.controller.scroll(dx, dy)
+            return True
+        generation = self.generation
+        started = time.perf_counter()
+        done_x = done_y = 0
+        for i in range(1, steps + 1):
+            if self.generation != generation:
+                self.cancelled += 1
+                return False
+            step_x = round(dx * i / steps) - done_x
+            step_y = round(dy * i / steps) - done_y
+            self.controller.scroll(step_x, step_y)
+            done_x += step_x
+            done_y += step_y
+            delay = started + i * SCROLL_STEP_INTERVAL - time.perf_counter()
+            if delay > 0 and i < steps:
+                time.sleep(delay)
+        return True
+
+    async def drag(self, start_x, start_y, end_x, end_y, button, mode=None):
+        await self.move_to_async(start_x, start_y, mode)
+        self.controller.press(button)
+        try:
+            await self.move_to_async(end_x, end_y, mode)
+        finally:
+            self.controller.release(button)
+
+    async def hold(self, button, seconds):
+        self.controller.press(button)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.controller.release(button)
+
+    def stats(self):
+        return {
+            "mode": self.current_mode(),
+            "moves": self.moves,
+            "cancelled": self.cancelled,
+            "distance_px": round(self.distance_px),
+            "duration": self.durations.summary(),
+        }
+
+
+_MOUSE_MOTION = MouseMotionEngine(_MOUSE_CONTROLLER)
+
+
+def _mouse_button(button):
+    if button not in ("left", "right"):
+        raise ValueError(f"Unknown mouse button '{button}', expected 'left' or 'right'")
+    return mouse.Button.left if button == "left" else mouse.Button.right
+
+
+def get_screen_size():
+    """Get the screen size."""
+    return {"width": pyautogui.size()[0], "height": pyautogui.size()[1]}
+
+def get_mouse_position():
+    """Get the mouse position."""
+    return {"x": _MOUSE_CONTROLLER.position[0], "y": _MOUSE_CONTROLLER.position[1]}
+
+def move_mouse_relative(x: int, y: int):
+    """Move the mouse relative to the current position. x is the horizontal distance to move and y is the vertical distance to move.
+    x is the distance from the left edge of the screen and y is the distance from the top edge of the screen.
+    So get the current mouse position first, then add the x and y to the current position.
+    """
+    if not _MOUSE_MOTION.move_by(x, y):
+        return {"error": "mouse move was cancelled"}
+    return {"result": f"mouse current position is {_MOUSE_CONTROLLER.position}"}
+
+def move_mouse_absolute(x, y):
+    """
+    Move the mouse to (x, y) using the motion engine's current mode. x and y
+    are global mouse coordinates, which is what the detection tools return.
+    """
+    if not _MOUSE_MOTION.move_to(x, y):
+        return {"error": f"Mouse move to {(x, y)} was cancelled"}
+    return {"result": f"Mouse moved smoothly to {(x, y)}"}
+
+async def drag_mouse(start_x: int, start_y: int, end_x: int, end_y: int, button: str = "left"):
+    """Press a mouse button at the start point, move to the end point and release."""
+    await _MOUSE_MOTION.drag(start_x, start_y, end_x, end_y, _mouse_button(button))
+    return {"result": f"dragged with the {button} button from {(start_x, start_y)} to {(end_x, end_y)}"}
+
+async def hold_mouse_button(button: str = "left", seconds: float = DEFAULT_HOLD_SECONDS):
+    """Hold a mouse button down for the given time, then release it."""
+    seconds = min(max(float(seconds), 0.0), MAX_HOLD_SECONDS)
+    await _MOUSE_MOTION.hold(_mouse_button(button), seconds)
+    return {"result": f"held the {button} mouse button for {seconds:.2f}s"}
+
+
+def left_click_mouse(count: int = 1):
+    """Left click the mouse button once."""
+    _MOUSE_CONTROLLER.click(mouse.Button.left, count)
+    return {"result": f"left clicked the mouse button {count} times"}
+
+def right_click_mouse(count: int = 1):
+    """Right click the mouse button once."""
+    _MOUSE_CONTROLLER.click(mouse.Button.right, count)
+    return {"result": f"right clicked the mouse button {count} times"}
+
+def scroll_mouse_by(dx: int, dy: int):
+    """
+    Scroll the mouse by the given amounts.
+    dx: horizontal scroll steps (positive -> right)
+    dy: vertical scroll steps (positive -> up)
+    Multi-step scrolls are spread out unless the motion mode is instant.
+    """
+    if not _MOUSE_MOTION.scroll(dx, dy):
+        return {"error": "scroll was cancelled"}
+    return {"result": f"scrolled by dx={dx}, dy={dy}"}
+
+
+def press_key(key: str):
+    """Press the given key. key is the key to press. key is a string of the key to press.
+    """
+    special_keys = {
+        "space": keyboard.Key.space,
+        "enter": keyboard.Key.enter,
+        "shift": keyboard.Key.shift,
+        "ctrl": keyboard.Key.ctrl,
+        "alt": keyboard.Key.alt,
+        "cmd": keyboard.Key.cmd,
+        "tab": keyboard.Key.tab,
+        "esc": keyboard.Key.esc,
+        "up": keyboard.Key.up,
+        "down": keyboard.Key.down,
+        "left": keyboard.Key.left,
+        "right": keyboard.Key.right,
+        "backspace": keyboard.Key.backspace,
+        "delete": keyboard.Key.delete,
+    }
+    if key in special_keys:
+        _KEYBOARD_CONTROLLER.press(special_keys[key])
+    else:
+        _KEYBOARD_CONTROLLER.press(key)
+    return {"result": f"pressed the key {key}"}
+
+# === Text entry ===
+TEXT_ENTRY_MODES = ("auto", "type", "paste")
+TEXT_ENTRY_MODE = "auto"
+PASTE_MIN_CHARS = 40
+CLIPBOARD_SETTLE_SECONDS = 0.15
+
+
+def _shortcut_modifier():
+    return keyboard.Key.cmd if platform.system().lower() == "darwin" else keyboard.Key.ctrl
+
+
+class TextEntry:
+    """
+    Enters text with synthetic keystrokes or, for long text, a clipboard paste.
+
+    In "auto" mode text of PASTE_MIN_CHARS or more is pasted (Cmd/Ctrl+V); the
+    previous clipboard is put back afterwards unless something else replaced
+    it meanwhile. Falls back to keystrokes when pyperclip has no clipboard
+    backend. Tracks characters per second per method.
+    """
+
+    def __init__(self, controller, mode=None, paste_min_chars=None):
+        self.controller = controller
+        self.mode = mode
+        self.paste_min_chars = paste_min_chars
+        self._pyperclip = None
+        self._clipboard_error = None
+        self.totals = {}
+        self.paste_failures = 0
+
+    def _clipboard(self):
+        if self._pyperclip is None and self._clipboard_error is None:
+            try:
+                import pyperclip
+                pyperclip.paste()
+                self._pyperclip = pyperclip
+            except Exception as e:
+                self._clipboard_error = str(e)
+                print(f"[LOG] Clipboard paste unavailable, typing instead: {e}")
+        return self._pyperclip
+
+    def method_for(self, text):
+        mode = self.mode or TEXT_ENTRY_MODE
+        if mode == "auto":
+            min_chars = PASTE_MIN_CHARS if self.paste_min_chars is None else self.paste_min_chars
+            mode = "paste" if 0 < min_chars <= len(text) else "type"
+        if mode == "paste" and self._clipboard() is None:
+            return "type"
+        return mode
+
+    def _paste(self, text):
+        pyperclip = self._pyperclip
+        try:
+            previous = pyperclip.paste()
+        except Exception:
+            previous = None
+        pyperclip.copy(text)
+        with self.controller.pressed(_shortcut_modifier()):
+            self.controller.press("v")
+            self.controller.release("v")
+        # The target app reads the clipboard asynchronously; restore too early and it pastes the old value.
+        time.sleep(CLIPBOARD_SETTLE_SECONDS)
+        if previous is not None:
+            try:
+                if pyperclip.paste() == text:
+                    pyperclip.copy(previous)
+            except Exception:
+                pass
+
+    def enter(self, text):
+        """Enter text at the cursor. Returns (method, seconds)."""
+        method = self.method_for(text)
+        started = time.perf_counter()
+        if method == "paste":
+            try:
+                self._paste(text)
+            except Exception as e:
+                self.paste_failures += 1
+                print(f"[LOG] Clipboard paste failed, typing instead: {e}")
+                method = "type"
+                started = time.perf_counter()
+        if method == "type":
+            self.controller.type(text)
+        elapsed = time.perf_counter() - started
+        total = self.totals.setdefault(method, {"calls": 0, "chars": 0, "seconds": 0.0})
+        total["calls"] += 1
+        total["chars"] += len(text)
+        total["seconds"] += elapsed
+        return method, elapsed
+
+    def stats(self):
+        return {
+            "mode": self.mode or TEXT_ENTRY_MODE,
+            "paste_failures": self.paste_failures,
+            "clipboard_error": self._clipboard_error,
+            **{
+                method: {
+                    "calls": total["calls"],
+                    "chars": total["chars"],
+                    "chars_per_sec": round(total["chars"] / total["seconds"], 1) if total["seconds"] else None,
+                }
+                for method, total in self.totals.items()
+            },
+        }
+
+
+_TEXT_ENTRY = TextEntry(_KEYBOARD_CONTROLLER)
 
-import platform
-import time
-from pynput import keyboard
 
 def type_text(text: str, select_all_first: bool = False):
     """
     Type text at the current cursor position.
     If select_all_first is True, will select all existing text (Cmd/Ctrl+A, Delete) before typing.
+    Long text is pasted through the clipboard (see TextEntry).
     """
-    _keyboard = keyboard.Controller()
-    system = platform.system().lower()
+    _keyboard = _KEYBOARD_CONTROLLER
 
     try:
         if select_all_first:
-            modifier = keyboard.Key.cmd if system == "darwin" else keyboard.Key.ctrl
-
             # Select all (Cmd/Ctrl + A)
-            with _keyboard.pressed(modifier):
+            with _keyboard.pressed(_shortcut_modifier()):
                 _keyboard.press('a')
                 _keyboard.release('a')
             time.sleep(0.05)
@@ -458,11 +2013,14 @@ def type_text(text: str, select_all_first: bool = False):
             _keyboard.release(keyboard.Key.delete)
             time.sleep(0.05)
 
-        # Type new text
-        _keyboard.type(text)
+        # Enter new text
+        method, elapsed = _TEXT_ENTRY.enter(text)
+        chars_per_sec = round(len(text) / elapsed, 1) if elapsed > 0 else None
 
         return {
-            "result": f"Typed: '{text}'" + (" (replaced existing text)" if select_all_first else "")
+            "result": f"Typed: '{text}'" + (" (replaced existing text)" if select_all_first else ""),
+            "method": method,
+            "chars_per_sec": chars_per_sec,
         }
 
     except Exception as e:
@@ -482,7 +2040,7 @@ def press_key_combination(keys: list):
     keys: list of key names to press together.
     Example: ["cmd", "c"] for copy, ["cmd", "v"] for paste.
     """
-    _keyboard = keyboard.Controller()
+    _keyboard = _KEYBOARD_CONTROLLER
     special_keys = {
         "space": keyboard.Key.space,
         "enter": keyboard.Key.enter,
@@ -523,19 +2081,19 @@ def press_key_combination(keys: list):
 
 def hold_left_mouse_button():
     """Hold the left mouse button down."""
-    mouse.Controller().press(mouse.Button.left)
+    _MOUSE_CONTROLLER.press(mouse.Button.left)
     return {"result": f"held the left mouse button down"}
 def release_left_mouse_button():
     """Release the left mouse button."""
-    mouse.Controller().release(mouse.Button.left)
+    _MOUSE_CONTROLLER.release(mouse.Button.left)
     return {"result": f"released the left mouse button"}
 def hold_right_mouse_button():
     """Hold the right mouse button down."""
-    mouse.Controller().press(mouse.Button.right)
+    _MOUSE_CONTROLLER.press(mouse.Button.right)
     return {"result": f"held the right mouse button down"}
 def release_right_mouse_button():
     """Release the right mouse button."""
-    mouse.Controller().release(mouse.Button.right)
+    _MOUSE_CONTROLLER.release(mouse.Button.right)
     return {"result": f"released the right mouse button"}
 # def get_screen_with_grid():
 #     """Capture the screen, draw a 25px grid, and mark coordinates."""
@@ -586,6 +2144,99 @@ def release_right_mouse_button():
 #     }
 
 
+# === Batched actions ===
+# Actions execute_actions may run; detection/quiz tools are not allowed in a batch.
+BATCHABLE_ACTIONS = (
+    "move_mouse_relative",
+    "move_mouse_absolute",
+    "left_click_mouse",
+    "right_click_mouse",
+    "hold_left_mouse_button",
+    "release_left_mouse_button",
+    "hold_right_mouse_button",
+    "release_right_mouse_button",
+    "scroll_mouse_by",
+    "press_key",
+    "type_text",
+    "select_all_and_replace",
+    "press_key_combination",
+    "get_mouse_position",
+    "get_screen_size",
+)
+MAX_ACTION_WAIT_MS = 5000
+
+
+def execute_actions(actions: list, stop_on_error: bool = True):
+    """
+    Run an ordered list of mouse/keyboard actions in one tool call.
+    Each action is {"action": name, ...arguments..., "wait_ms": optional pause after the step}.
+    Arguments may also be nested under "args". Returns per-step results and timings.
+    """
+    started = time.perf_counter()
+    generation = _MOUSE_MOTION.generation
+    steps = []
+    for index, step in enumerate(actions or []):
+        if _MOUSE_MOTION.generation != generation:
+            steps.append({"step": index, "error": "cancelled"})
+            break
+        step = dict(step)
+        name = step.pop("action", None)
+        wait_ms = min(float(step.pop("wait_ms", 0) or 0), MAX_ACTION_WAIT_MS)
+        args = step.pop("args", None) or step
+        step_started = time.perf_counter()
+        entry = {"step": index, "action": name}
+        try:
+            if name not in BATCHABLE_ACTIONS:
+                raise ValueError(f"Action '{name}' is not allowed in execute_actions")
+            func = func_names_dict[name]
+            accepted = inspect.signature(func).parameters
+            result = func(**{key: value for key, value in args.items() if key in accepted})
+            if "error" in result:
+                entry["error"] = result["error"]
+            else:
+                entry["result"] = result.get("result", result)
+        except Exception as e:
+            entry["error"] = str(e)
+        entry["ms"] = round((time.perf_counter() - step_started) * 1000, 1)
+        steps.append(entry)
+        if "error" in entry and stop_on_error:
+            break
+        if wait_ms > 0:
+            time.sleep(wait_ms / 1000)
+
+    failed = [entry["step"] for entry in steps if "error" in entry]
+    return {
+        "result": f"Ran {len(steps)} of {len(actions or [])} actions" + (f", failed steps: {failed}" if failed else ""),
+        "steps": steps,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+async def click_element(prompt: str, button: str = "left", count: int = 1, use_cache: bool = True):
+    """
+    Detect a UI element from its description, move the mouse to it and click,
+    all in one tool call (detect -> move -> click without model round trips).
+    """
+    started = time.perf_counter()
+    detection = await smart_detect_screen_coordinates(prompt, use_cache=use_cache)
+    detect_ms = round((time.perf_counter() - started) * 1000, 1)
+    coords = parse_coordinates(detection.get("result"))
+    if coords is None:
+        return {"error": f"Could not find '{prompt}' on screen", "detection": detection.get("result"),
+                "detect_ms": detect_ms}
+
+    x, y = coords
+    click_started = time.perf_counter()
+    await _MOUSE_MOTION.move_to_async(x, y)
+    _MOUSE_CONTROLLER.click(_mouse_button(button), int(count))
+    return {
+        "result": f"{button} clicked '{prompt}' at x={x}, y={y}",
+        "cached": bool(detection.get("cached")),
+        "detect_ms": detect_ms,
+        "move_click_ms": round((time.perf_counter() - click_started) * 1000, 1),
+    }
+
+
 func_names_dict = {
     "move_mouse_relative": move_mouse_relative,
     "move_mouse_absolute": move_mouse_absolute,
@@ -604,129 +2255,372 @@ func_names_dict = {
     "get_mouse_position": get_mouse_position,
     "generate_quiz_from_screen": generate_quiz_from_screen,
     # "get_screen_with_grid": get_screen_with_grid
-    "smart_detect_screen_coordinates": smart_detect_screen_coordinates
+    "smart_detect_screen_coordinates": smart_detect_screen_coordinates,
+    "execute_actions": execute_actions,
+    "click_element": click_element,
+    "drag_mouse": drag_mouse,
+    "hold_mouse_button": hold_mouse_button,
 }
 
 
+# === Tool execution ===
+TOOL_WORKERS = 4
+DEFAULT_TOOL_TIMEOUT = 15.0
+TOOL_TIMEOUTS = {
+    "smart_detect_screen_coordinates": 60.0,
+    "generate_quiz_from_screen": 90.0,
+    "click_element": 70.0,
+    "execute_actions": 60.0,
+}
 
-tools = [
-   types.Tool(
-    function_declarations=[
-        types.FunctionDeclaration(
-            name="move_mouse_relative",
-            description="Move the mouse to the given coordinates.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"x": types.Schema(type=types.Type.NUMBER), "y": types.Schema(type=types.Type.NUMBER)})
-        ),
-        types.FunctionDeclaration(
-            name="hold_left_mouse_button",
-            description="Hold the left mouse button down.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        ),
-        types.FunctionDeclaration(
-            name="release_left_mouse_button",
-            description="Release the left mouse button.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        ),
-        types.FunctionDeclaration(
-            name="hold_right_mouse_button",
-            description="Hold the right mouse button down.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        ),
-        types.FunctionDeclaration(
-            name="release_right_mouse_button",
-            description="Release the right mouse button.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        ),
-        types.FunctionDeclaration(
-            name="move_mouse_absolute",
-            description="Call get screen_size before calling this function. Move the mouse to the given coordinates. x is the horizontal coordinate and y is the vertical coordinate. x is the distance from the left edge of the screen and y is the distance from the top edge of the screen.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"x": types.Schema(type=types.Type.NUMBER), "y": types.Schema(type=types.Type.NUMBER)})
-        ),
-        types.FunctionDeclaration(
-            name="left_click_mouse",
-            description= "Left click the mouse button once. count is the number of times to click the mouse button. count is an optional parameter and default is 1.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"count": types.Schema(type=types.Type.NUMBER)})
-        ),
-        types.FunctionDeclaration(
-            name="right_click_mouse",
-            description="Right click the mouse button once.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"count": types.Schema(type=types.Type.NUMBER)})
-        ),
-        types.FunctionDeclaration(
-            name="scroll_mouse_by",
-            description="Scroll the mouse by the given amounts. dx is the horizontal scroll steps (positive -> right) and dy is the vertical scroll steps (positive -> up).",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"dx": types.Schema(type=types.Type.NUMBER), "dy": types.Schema(type=types.Type.NUMBER)})
-        ),
-        types.FunctionDeclaration(
-            name="press_key",
-            description="Press the given key. key is a string of the key to press. key is a special key or a regular key. special keys are space, enter, shift, ctrl, alt, cmd, tab, esc, up, down, left, right, backspace, delete. regular keys are the keys on the keyboard.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"key": types.Schema(type=types.Type.STRING)})
-        ),
-        types.FunctionDeclaration(
-            name="type_text",
-            description="Type text at the current cursor position. If select_all_first is True, will select all existing text (Cmd+A) before typing to replace it. Very useful for filling forms or replacing text in input fields.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={
-                "text": types.Schema(type=types.Type.STRING, description="The text to type"),
-                "select_all_first": types.Schema(type=types.Type.BOOLEAN, description="If True, select all text before typing (replaces existing text). Default is False.")
-            }, required=["text"])
-        ),
-        types.FunctionDeclaration(
-            name="select_all_and_replace",
-            description="Select all text in the current field (Cmd+A) and replace it with new text. Perfect for replacing text in input fields, text boxes, or editors.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={
-                "text": types.Schema(type=types.Type.STRING, description="The new text to replace with")
-            }, required=["text"])
-        ),
-        types.FunctionDeclaration(
-            name="press_key_combination",
-            description="Press a combination of keys simultaneously. Useful for keyboard shortcuts like Cmd+C (copy), Cmd+V (paste), Cmd+S (save), etc. Keys are pressed in order and released in reverse order.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={
-                "keys": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING), description="List of keys to press together. Example: ['cmd', 'c'] for copy, ['cmd', 'v'] for paste, ['cmd', 'shift', 's'] for save as.")
-            }, required=["keys"])
-        ),
-        types.FunctionDeclaration(
-            name="get_screen_size",
-            description="Get the screen size.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        ),
-        types.FunctionDeclaration(
-            name="get_mouse_position",
-            description="Get the mouse position.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        ),
-        # types.FunctionDeclaration(
-        #     name="get_screen_with_grid",
-        #     description="Get the screen with a custom visible cursor overlay and a 25px grid. This function is used to help the screen capture and the mouse position. Call this function before decideding on coordinates to move the mouse to.",
-        #     parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        # )
-        types.FunctionDeclaration(
-            name="smart_detect_screen_coordinates",
-            description="Smart detect the screen coordinates based on the prompt. Call this function before decideding on coordinates to move the mouse to.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={"prompt": types.Schema(type=types.Type.STRING)})
-        ),
-        types.FunctionDeclaration(
-            name="generate_quiz_from_screen",
-            description="Generate a fun quiz based on what's currently visible on screen! Creates 2 questions about screen content and 1 creative/fun question. Perfect for entertainment, learning, or testing knowledge about what's displayed. The AI will analyze the screen and create engaging questions.",
-            parameters=types.Schema(type=types.Type.OBJECT, properties={})
-        )
-    ]
-   )
-]
+# Tools that drive the mouse/keyboard. They run one at a time, in the order
+# the model called them; everything else may run in parallel.
+INPUT_TOOLS = {
+    "move_mouse_relative",
+    "move_mouse_absolute",
+    "left_click_mouse",
+    "right_click_mouse",
+    "hold_left_mouse_button",
+    "release_left_mouse_button",
+    "hold_right_mouse_button",
+    "release_right_mouse_button",
+    "scroll_mouse_by",
+    "press_key",
+    "type_text",
+    "select_all_and_replace",
+    "press_key_combination",
+    "execute_actions",
+    "click_element",
+    "drag_mouse",
+    "hold_mouse_button",
+}
+
+
+class ToolExecutor:
+    """
+    Runs tool calls off the event loop.
+
+    Sync tools run on a thread pool, coroutine tools are awaited directly.
+    Each call gets a timeout from TOOL_TIMEOUTS (DEFAULT_TOOL_TIMEOUT
+    otherwise). Note that a timed-out *thread* cannot be killed; the model
+    gets an error response right away and the thread finishes in the
+    background. For input tools the input lock stays held until that
+    thread has finished, so the next input tool cannot interleave with it.
+    """
+
+    def __init__(self, tools=None, max_workers=TOOL_WORKERS, timeouts=None,
+                 default_timeout=DEFAULT_TOOL_TIMEOUT, tracer=None):
+        self.tools = func_names_dict if tools is None else tools
+        self.tracer = tracer
+        self.timeouts = TOOL_TIMEOUTS if timeouts is None else timeouts
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._input_lock = asyncio.Lock()
+        self._pending = {}
+        self._cancel_requested = set()
+
+        self.timings = {}
+        self.timed_out = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.input_lock_held_for_workers = 0
+
+    def timeout_for(self, name):
+        return self.timeouts.get(name, self.default_timeout)
+
+    async def _invoke(self, name, args, workers=None):
+        """Run a tool; sync tools' thread futures are appended to workers when given."""
+        func = self.tools[name]
+        if asyncio.iscoroutinefunction(func):
+            return await func(**args)
+        future = self._pool.submit(functools.partial(func, **args))
+        if workers is not None:
+            workers.append(future)
+        return await asyncio.wrap_future(future)
+
+    def _release_input_lock(self, name, workers):
+        """Release the input lock now, or once a still-running worker thread finishes."""
+        running = [future for future in workers if not future.done()]
+        if not running:
+            self._input_lock.release()
+            return
+        self.input_lock_held_for_workers += 1
+        print(f"[LOG] Input lock held until the {name} worker thread finishes")
+        loop = asyncio.get_running_loop()
+
+        def release(_future):
+            try:
+                loop.call_soon_threadsafe(self._input_lock.release)
+            except RuntimeError:  # event loop already closed
+                pass
 
+        running[0].add_done_callback(release)
+
+    def _response(self, fc, result):
+        """Build the FunctionResponse, wrapping non-dict results as {"result": ...}."""
+        if not isinstance(result, dict):
+            result = {"result": result}
+        try:
+            return types.FunctionResponse(id=fc.id, name=fc.name, response=result)
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Tool {fc.name} returned an invalid result: {e}")
+            return types.FunctionResponse(id=fc.id, name=fc.name,
+                                          response={"error": f"Tool {fc.name} returned an invalid result: {e}"})
+
+    async def _run(self, fc):
+        name = fc.name
+        args = dict(fc.args or {})
+        started = time.monotonic()
+        try:
+            if name not in self.tools:
+                raise KeyError(f"Unknown tool '{name}'")
+            if name in INPUT_TOOLS:
+                workers = []
+                await self._input_lock.acquire()
+                try:
+                    result = await asyncio.wait_for(self._invoke(name, args, workers), self.timeout_for(name))
+                finally:
+                    self._release_input_lock(name, workers)
+            else:
+                result = await asyncio.wait_for(self._invoke(name, args), self.timeout_for(name))
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            if name in INPUT_TOOLS:
+                _MOUSE_MOTION.cancel()
+            print(f"⏱️ Tool {name} timed out after {self.timeout_for(name):.1f}s")
+            result = {"error": f"Tool {name} timed out after {self.timeout_for(name):.1f}s"}
+        except asyncio.CancelledError:
+            if fc.id not in self._cancel_requested:
+                raise
+            self.cancelled += 1
+            if name in INPUT_TOOLS:
+                _MOUSE_MOTION.cancel()
+            print(f"🚫 Tool {name} cancelled")
+            result = {"error": f"Tool {name} was cancelled"}
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Tool {name} failed: {e}")
+            result = {"error": str(e)}
+        finally:
+            self._cancel_requested.discard(fc.id)
+            finished = time.monotonic()
+            self.timings.setdefault(name, LatencyStats()).add(finished - started)
+            if self.tracer is not None:
+                self.tracer.record("tool.exec", started, finished, tool=name, call_id=fc.id)
+
+        return self._response(fc, result)
+
+    def submit(self, fc):
+        """Start a function call and return its task (resolves to a FunctionResponse)."""
+        task = asyncio.ensure_future(self._run(fc))
+        if fc.id:
+            self._pending[fc.id] = task
+            task.add_done_callback(lambda _t, call_id=fc.id: self._pending.pop(call_id, None))
+        return task
+
+    async def run_all(self, function_calls):
+        """
+        Run the calls of one tool_call concurrently. Tasks are created in
+        call order, so input tools take the input lock in that order too.
+        """
+        tasks = [self.submit(fc) for fc in function_calls]
+        return list(await asyncio.gather(*tasks))
+
+    def cancel(self, ids):
+        """Cancel in-flight calls (e.g. on a server tool_call_cancellation)."""
+        for call_id in ids or []:
+            task = self._pending.get(call_id)
+            if task is not None and not task.done():
+                self._cancel_requested.add(call_id)
+                task.cancel()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "input_lock_held_for_workers": self.input_lock_held_for_workers,
+            "in_flight": len(self._pending),
+            "per_tool": {name: stats.summary() for name, stats in self.timings.items()},
+        }
 
 
 
-CONFIG = {"response_modalities": ["AUDIO"], "tools": tools
-,
-    "system_instruction": """You are an assistant that controls the user's mouse and keyboard based on voice commands.
+@functools.lru_cache(maxsize=None)
+def build_tools():
+    """Function declarations for the Live session (built on first use; needs google.genai)."""
+    return [
+       types.Tool(
+        function_declarations=[
+            types.FunctionDeclaration(
+                name="move_mouse_relative",
+                description="Move the mouse to the given coordinates.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={"x": types.Schema(type=types.Type.NUMBER), "y": types.Schema(type=types.Type.NUMBER)})
+            ),
+            types.FunctionDeclaration(
+                name="hold_left_mouse_button",
+                description="Hold the left mouse button down.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            ),
+            types.FunctionDeclaration(
+                name="release_left_mouse_button",
+                description="Release the left mouse button.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            ),
+            types.FunctionDeclaration(
+                name="hold_right_mouse_button",
+                description="Hold the right mouse button down.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            ),
+            types.FunctionDeclaration(
+                name="release_right_mouse_button",
+                description="Release the right mouse button.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            ),
+            types.FunctionDeclaration(
+                name="move_mouse_absolute",
+                description="Call get screen_size before calling this function. Move the mouse to the given coordinates. x is the horizontal coordinate and y is the vertical coordinate. x is the distance from the left edge of the screen and y is the distance from the top edge of the screen.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={"x": types.Schema(type=types.Type.NUMBER), "y": types.Schema(type=types.Type.NUMBER)})
+            ),
+            types.FunctionDeclaration(
+                name="left_click_mouse",
+                description= "Left click the mouse button once. count is the number of times to click the mouse button. count is an optional parameter and default is 1.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={"count": types.Schema(type=types.Type.NUMBER)})
+            ),
+            types.FunctionDeclaration(
+                name="right_click_mouse",
+                description="Right click the mouse button once.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={"count": types.Schema(type=types.Type.NUMBER)})
+            ),
+            types.FunctionDeclaration(
+                name="scroll_mouse_by",
+                description="Scroll the mouse by the given amounts. dx is the horizontal scroll steps (positive -> right) and dy is the vertical scroll steps (positive -> up).",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={"dx": types.Schema(type=types.Type.NUMBER), "dy": types.Schema(type=types.Type.NUMBER)})
+            ),
+            types.FunctionDeclaration(
+                name="press_key",
+                description="Press the given key. key is a string of the key to press. key is a special key or a regular key. special keys are space, enter, shift, ctrl, alt, cmd, tab, esc, up, down, left, right, backspace, delete. regular keys are the keys on the keyboard.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={"key": types.Schema(type=types.Type.STRING)})
+            ),
+            types.FunctionDeclaration(
+                name="type_text",
+                description="Type text at the current cursor position. If select_all_first is True, will select all existing text (Cmd+A) before typing to replace it. Very useful for filling forms or replacing text in input fields.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "text": types.Schema(type=types.Type.STRING, description="The text to type"),
+                    "select_all_first": types.Schema(type=types.Type.BOOLEAN, description="If True, select all text before typing (replaces existing text). Default is False.")
+                }, required=["text"])
+            ),
+            types.FunctionDeclaration(
+                name="select_all_and_replace",
+                description="Select all text in the current field (Cmd+A) and replace it with new text. Perfect for replacing text in input fields, text boxes, or editors.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "text": types.Schema(type=types.Type.STRING, description="The new text to replace with")
+                }, required=["text"])
+            ),
+            types.FunctionDeclaration(
+                name="press_key_combination",
+                description="Press a combination of keys simultaneously. Useful for keyboard shortcuts like Cmd+C (copy), Cmd+V (paste), Cmd+S (save), etc. Keys are pressed in order and released in reverse order.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "keys": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING), description="List of keys to press together. Example: ['cmd', 'c'] for copy, ['cmd', 'v'] for paste, ['cmd', 'shift', 's'] for save as.")
+                }, required=["keys"])
+            ),
+            types.FunctionDeclaration(
+                name="get_screen_size",
+                description="Get the screen size.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            ),
+            types.FunctionDeclaration(
+                name="get_mouse_position",
+                description="Get the mouse position.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            ),
+            # types.FunctionDeclaration(
+            #     name="get_screen_with_grid",
+            #     description="Get the screen with a custom visible cursor overlay and a 25px grid. This function is used to help the screen capture and the mouse position. Call this function before decideding on coordinates to move the mouse to.",
+            #     parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            # )
+            types.FunctionDeclaration(
+                name="smart_detect_screen_coordinates",
+                description="Smart detect the screen coordinates based on the prompt. Call this function before decideding on coordinates to move the mouse to.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "prompt": types.Schema(type=types.Type.STRING),
+                    "use_cache": types.Schema(type=types.Type.BOOLEAN, description="Reuse a recent result for the same element on an unchanged screen. Set to False if the previous coordinates were wrong. Default is True.")
+                }, required=["prompt"])
+            ),
+            types.FunctionDeclaration(
+                name="drag_mouse",
+                description="Drag with a mouse button held down from a start point to an end point (e.g. move a window, select text, drag a file).",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "start_x": types.Schema(type=types.Type.NUMBER, description="Start x coordinate"),
+                    "start_y": types.Schema(type=types.Type.NUMBER, description="Start y coordinate"),
+                    "end_x": types.Schema(type=types.Type.NUMBER, description="End x coordinate"),
+                    "end_y": types.Schema(type=types.Type.NUMBER, description="End y coordinate"),
+                    "button": types.Schema(type=types.Type.STRING, enum=["left", "right"], description="Mouse button. Default is left.")
+                }, required=["start_x", "start_y", "end_x", "end_y"])
+            ),
+            types.FunctionDeclaration(
+                name="hold_mouse_button",
+                description="Hold a mouse button down at the current position for some seconds, then release it (long press).",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "button": types.Schema(type=types.Type.STRING, enum=["left", "right"], description="Mouse button. Default is left."),
+                    "seconds": types.Schema(type=types.Type.NUMBER, description="How long to hold, up to 10 seconds. Default is 0.5.")
+                })
+            ),
+            types.FunctionDeclaration(
+                name="click_element",
+                description="Find a UI element on screen from its description, move the mouse to it and click it, all in one step. Prefer this over calling smart_detect_screen_coordinates, move_mouse_absolute and left_click_mouse separately.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "prompt": types.Schema(type=types.Type.STRING, description="Description of the element to click, e.g. 'Discord icon in the dock'"),
+                    "button": types.Schema(type=types.Type.STRING, enum=["left", "right"], description="Mouse button. Default is left."),
+                    "count": types.Schema(type=types.Type.NUMBER, description="Number of clicks (2 for double click). Default is 1."),
+                    "use_cache": types.Schema(type=types.Type.BOOLEAN, description="Reuse a recent detection for the same element. Set to False if the last click missed. Default is True.")
+                }, required=["prompt"])
+            ),
+            types.FunctionDeclaration(
+                name="execute_actions",
+                description="Run several mouse and keyboard actions in order in a single call, e.g. click a field, type text and press enter. Each action names one of the mouse/keyboard tools plus its arguments, and can wait wait_ms milliseconds afterwards. Returns per-step results.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={
+                    "actions": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.OBJECT, properties={
+                        "action": types.Schema(type=types.Type.STRING, enum=list(BATCHABLE_ACTIONS)),
+                        "x": types.Schema(type=types.Type.NUMBER),
+                        "y": types.Schema(type=types.Type.NUMBER),
+                        "dx": types.Schema(type=types.Type.NUMBER),
+                        "dy": types.Schema(type=types.Type.NUMBER),
+                        "count": types.Schema(type=types.Type.NUMBER),
+                        "key": types.Schema(type=types.Type.STRING),
+                        "keys": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+                        "text": types.Schema(type=types.Type.STRING),
+                        "select_all_first": types.Schema(type=types.Type.BOOLEAN),
+                        "wait_ms": types.Schema(type=types.Type.NUMBER, description="Pause after this step, in milliseconds")
+                    }, required=["action"])),
+                    "stop_on_error": types.Schema(type=types.Type.BOOLEAN, description="Stop at the first failing step. Default is True.")
+                }, required=["actions"])
+            ),
+            types.FunctionDeclaration(
+                name="generate_quiz_from_screen",
+                description="Generate a fun quiz based on what's currently visible on screen! Creates 2 questions about screen content and 1 creative/fun question. Perfect for entertainment, learning, or testing knowledge about what's displayed. The AI will analyze the screen and create engaging questions.",
+                parameters=types.Schema(type=types.Type.OBJECT, properties={})
+            )
+        ]
+       )
+    ]
+
 
-CRITICAL WORKFLOW - When clicking on UI elements, ALWAYS follow this sequence:
-1. FIRST: Call smart_detect_screen_coordinates(prompt="description of element") to find the coordinates
-2. SECOND: Extract the x,y coordinates from the result (format: "x=123, y=456")
-3. THIRD: Call move_mouse_absolute(x, y) to move the mouse to those coordinates
-4. FOURTH: Call left_click_mouse() to click at that position
+SYSTEM_INSTRUCTION = """You are an assistant that controls the user's mouse and keyboard based on voice commands.
 
-NEVER skip step 3! The mouse must move to the detected coordinates before clicking.
+CRITICAL WORKFLOW - When clicking on UI elements:
+- Call click_element(prompt="description of element"). It finds the element, moves the mouse there and clicks in one step.
+- Only if you need the coordinates themselves, use the manual sequence:
+  1. Call smart_detect_screen_coordinates(prompt="description of element") to find the coordinates
+  2. Extract the x,y coordinates from the result (format: "x=123, y=456")
+  3. Call move_mouse_absolute(x, y) to move the mouse to those coordinates
+  4. Call left_click_mouse() to click at that position
+  NEVER skip step 3! The mouse must move to the detected coordinates before clicking.
+- When you already know a sequence of mouse/keyboard steps (e.g. type text then press enter), run them with one execute_actions call.
 
 General rules:
 - Always use smart_detect_screen_coordinates when you don't know exact coordinates - never guess!
@@ -735,15 +2629,858 @@ General rules:
 - If something is not possible, say so and don't try to do it
 - Use all available tools in the correct order and sequence
      """
-}
 
-pya = pyaudio.PyAudio()
+
+def build_config():
+    """Live API session config."""
+    return {"response_modalities": ["AUDIO"], "tools": build_tools(), "system_instruction": SYSTEM_INSTRUCTION}
+
+# === Screen change detection ===
+# Frames are split into square tiles; a frame is only sent when at least
+# SCREEN_CHANGE_THRESHOLD of the tiles (or SCREEN_CHANGE_MIN_TILES tiles,
+# whichever is fewer) differ from the last *sent* frame, or when the
+# cursor moved. The tile floor keeps small real changes (a 200x30 px
+# tooltip is ~0.17% of a 4K screen) from being suppressed on big screens.
+SCREEN_CHANGE_TILE_SIZE = 32
+SCREEN_CHANGE_THRESHOLD = 0.002
+SCREEN_CHANGE_MIN_TILES = 4
+
+
+class FrameChangeDetector:
+    """
+    Tile-hash change detector for streamed screen frames.
+
+    Each tile gets a cheap 2x64-bit signature (sum + xor of its 32-bit
+    pixels), computed with np.add.reduceat / np.bitwise_xor.reduceat so the
+    whole frame is hashed without Python-level loops or a full-frame copy.
+    """
+
+    def __init__(self, tile_size=SCREEN_CHANGE_TILE_SIZE, threshold=SCREEN_CHANGE_THRESHOLD,
+                 min_tiles=SCREEN_CHANGE_MIN_TILES):
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.min_tiles = min_tiles
+        self._last_signature = None
+        self._last_cursor = None
+        self.last_changed_fraction = 1.0
+
+        self.frames_captured = 0
+        self.frames_suppressed = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        self._last_sent_size = 0
+        self.cursor_sends = 0
+        self.resets = 0
+
+    def _signature(self, frame):
+        """Return (sums, xors) per-tile arrays for a HxWx4 uint8 frame."""
+        frame = np.ascontiguousarray(frame)
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            pixels = frame.view(np.uint32)[..., 0]
+        else:
+            pixels = frame.reshape(frame.shape[0], -1)
+        height, width = pixels.shape
+        # Tiles are tile_size *pixels* wide, whatever the channel layout
+        col_step = self.tile_size * (width // frame.shape[1])
+        rows = np.arange(0, height, self.tile_size)
+        cols = np.arange(0, width, col_step)
+
+        sums = np.add.reduceat(pixels, rows, axis=0, dtype=np.uint64)
+        sums = np.add.reduceat(sums, cols, axis=1)
+        xors = np.bitwise_xor.reduceat(pixels, rows, axis=0)
+        xors = np.bitwise_xor.reduceat(xors, cols, axis=1)
+        return sums, xors
+
+    def check(self, frame, cursor=None):
+        """
+        Decide whether a captured frame should be sent.
+        Returns True when enough tiles changed (see SCREEN_CHANGE_MIN_TILES)
+        or the cursor position differs from the last sent frame's. Pass
+        the cursor position when the frame is checked before the cursor
+        overlay is drawn. The reference signature only advances on sent
+        frames, so slow drifts still accumulate into a send eventually.
+        """
+        self.frames_captured += 1
+        sums, xors = self._signature(frame)
+
+        if self._last_signature is None or self._last_signature[0].shape != sums.shape:
+            changed_tiles = sums.size
+        else:
+            last_sums, last_xors = self._last_signature
+            changed_tiles = int(np.count_nonzero((sums != last_sums) | (xors != last_xors)))
+        changed_fraction = changed_tiles / sums.size
+        cursor_moved = cursor is not None and cursor != self._last_cursor
+
+        self.last_changed_fraction = changed_fraction
+        if (changed_fraction < self.threshold and changed_tiles < self.min_tiles
+                and not cursor_moved):
+            self.frames_suppressed += 1
+            self.bytes_saved += self._last_sent_size
+            return False
+
+        if cursor_moved and changed_fraction < self.threshold and changed_tiles < self.min_tiles:
+            self.cursor_sends += 1
+        self._last_signature = (sums, xors)
+        self._last_cursor = cursor
+        return True
+
+    def record_sent(self, num_bytes):
+        """Record the encoded size of a frame that passed check()."""
+        self.frames_sent += 1
+        self.bytes_sent += num_bytes
+        self._last_sent_size = num_bytes
+
+    def reset(self):
+        """Forget the reference frame so the next capture is always sent."""
+        self._last_signature = None
+        self.resets += 1
+
+    def stats(self):
+        return {
+            "frames_captured": self.frames_captured,
+            "frames_sent": self.frames_sent,
+            "frames_suppressed": self.frames_suppressed,
+            "bytes_sent": self.bytes_sent,
+            "bytes_saved": self.bytes_saved,
+            "last_changed_fraction": round(self.last_changed_fraction, 4),
+            "cursor_sends": self.cursor_sends,
+            "resets": self.resets,
+        }
+
+
+# === Cursor sprite ===
+# The cursor overlay on streamed screen frames is rendered once into a
+# premultiplied BGRA sprite and alpha-blended into each frame with numpy,
+# instead of being redrawn with cv2 primitives on every frame.
+CURSOR_STYLES = ("ring", "dot", "crosshair", "arrow", "none")
+CURSOR_STYLE = "ring"
+CURSOR_SIZE = 36                   # sprite side in pixels (the ring is 36 px across)
+CURSOR_COLOR = (0, 80, 255)        # BGR, orange-red
+CURSOR_SUPERSAMPLE = 4             # draw at 4x and downscale for anti-aliased edges
+
+
+def render_cursor_sprite(style=CURSOR_STYLE, size=CURSOR_SIZE, color=CURSOR_COLOR):
+    """
+    Render a cursor glyph into a premultiplied BGRA uint8 sprite.
+    Returns (sprite, hotspot) where hotspot is the (x, y) pixel that
+    lands on the cursor position.
+    """
+    k = CURSOR_SUPERSAMPLE
+    side = size * k
+    canvas = np.zeros((side, side, 4), dtype=np.uint8)
+    unit = side / 36.0  # the styles are laid out on a 36x36 grid
+    c = (side // 2, side // 2)
+
+    def px(value):
+        return max(1, int(round(value * unit)))
+
+    main = tuple(color) + (255,)
+    glow = (0, 120, 255, 255)
+    light = (0, 200, 255, 255)
+    white = (255, 255, 255, 255)
+
+    if style == "ring":
+        for r in (18, 16, 14):
+            cv2.circle(canvas, c, px(r) - px(1), glow, px(1))
+        cv2.circle(canvas, c, px(4), main, -1)
+        cv2.line(canvas, (c[0] - px(6), c[1]), (c[0] + px(6), c[1]), light, px(2))
+        cv2.line(canvas, (c[0], c[1] - px(6)), (c[0], c[1] + px(6)), light, px(2))
+        hotspot = (size // 2, size // 2)
+    elif style == "dot":
+        cv2.circle(canvas, c, px(8), white, -1)
+        cv2.circle(canvas, c, px(6), main, -1)
+        hotspot = (size // 2, size // 2)
+    elif style == "crosshair":
+        for colour, width in ((white, 5), (main, 2)):
+            cv2.line(canvas, (c[0] - px(14), c[1]), (c[0] + px(14), c[1]), colour, px(width))
+            cv2.line(canvas, (c[0], c[1] - px(14)), (c[0], c[1] + px(14)), colour, px(width))
+        hotspot = (size // 2, size // 2)
+    elif style == "arrow":
+        points = np.array([(1, 1), (1, 27), (8, 20), (13, 31), (18, 29), (13, 18), (23, 18)], dtype=np.float32)
+        points = np.round(points * unit).astype(np.int32)
+        cv2.fillPoly(canvas, [points], main)
+        cv2.polylines(canvas, [points], True, white, px(1.5))
+        tip = int(round(size / 36.0))
+        hotspot = (tip, tip)
+    elif style == "none":
+        return np.zeros((0, 0, 4), dtype=np.uint8), (0, 0)
+    else:
+        raise ValueError(f"Unknown cursor style '{style}', expected one of {CURSOR_STYLES}")
+
+    # The shapes are opaque, so colour * alpha after an area downscale is
+    # exactly the premultiplied anti-aliased result.
+    small = cv2.resize(canvas, (size, size), interpolation=cv2.INTER_AREA).astype(np.uint16)
+    alpha = small[..., 3:4]
+    bgr = small[..., :3] * alpha // 255
+    return np.concatenate([bgr, alpha], axis=2).astype(np.uint8), hotspot
+
+
+class CursorSprite:
+    """
+    Pre-rendered cursor overlay, alpha-blended into BGR/BGRA frames in place.
+
+    blit() clips the sprite against the frame edges, so the cursor can sit
+    partly (or fully) outside the captured region.
+    """
+
+    def __init__(self, style=None, size=None, color=CURSOR_COLOR):
+        self.style = style or CURSOR_STYLE
+        sprite, self.hotspot = render_cursor_sprite(self.style, size or CURSOR_SIZE, color)
+        # Blending is done in 8.8 fixed point, frame * (256 - alpha) + colour * 256,
+        # with both terms expanded to every frame channel up front: broadcasting
+        # an alpha plane or skipping the frame's alpha channel makes numpy take
+        # a strided path several times slower. A BGRA frame's alpha stays 255.
+        sprite = sprite.astype(np.uint32)
+        alpha = (sprite[..., 3:4] * 256 + 127) // 255
+        colour = np.concatenate([sprite[..., :3], np.full_like(alpha, 255)], axis=2)
+        inverse_alpha = np.repeat(256 - alpha, 4, axis=2).astype(np.uint16)
+        premultiplied = (colour * 256 + 128).astype(np.uint16)
+        premultiplied[..., 3:] = alpha * 255 + 128
+        # (inverse alpha, premultiplied colour) per frame channel count (BGR, BGRA)
+        self._layers = {
+            channels: (np.ascontiguousarray(inverse_alpha[..., :channels]),
+                       np.ascontiguousarray(premultiplied[..., :channels]))
+            for channels in (3, 4)
+        }
+
+        self.blits = 0
+        self.clipped = 0
+        self.offscreen = 0
+        self.blit_ms = 0.0
+
+    def blit(self, frame, x, y):
+        """Blend the sprite into frame with its hotspot at (x, y); False if nothing was drawn."""
+        inverse_alpha, premultiplied = self._layers[frame.shape[2]]
+        height, width = inverse_alpha.shape[:2]
+        if not height:
+            return False
+        start = time.perf_counter()
+        left, top = int(x) - self.hotspot[0], int(y) - self.hotspot[1]
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(left + width, frame.shape[1]), min(top + height, frame.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            self.offscreen += 1
+            return False
+        if (x1 - x0, y1 - y0) != (width, height):
+            self.clipped += 1
+
+        sprite_area = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+        dst = frame[y0:y1, x0:x1]
+        blended = dst * inverse_alpha[sprite_area]
+        blended += premultiplied[sprite_area]
+        blended >>= 8
+        dst[...] = blended
+
+        self.blits += 1
+        self.blit_ms += (time.perf_counter() - start) * 1000
+        return True
+
+    def stats(self):
+        return {
+            "style": self.style,
+            "blits": self.blits,
+            "clipped": self.clipped,
+            "offscreen": self.offscreen,
+            "mean_blit_us": round(self.blit_ms * 1000 / self.blits, 1) if self.blits else None,
+        }
+
+
+# === Adaptive frame rate ===
+SCREEN_MIN_FPS = 0.2
+SCREEN_MAX_FPS = 2.0
+CAMERA_MIN_FPS = 2.0
+CAMERA_MAX_FPS = 10.0
+
+
+class AdaptiveFrameRateController:
+    """
+    Picks the delay before the next frame capture.
+
+    Screen changes above activity_threshold or an in-flight tool call boost
+    the rate to max_fps; it then decays back towards min_fps with a
+    half-life of decay_seconds. When the outgoing queue is fuller than
+    backlog_threshold the rate is pulled down towards min_fps so video
+    never piles up in front of audio.
+    """
+
+    def __init__(self, min_fps, max_fps, activity_threshold=0.01, decay_seconds=3.0,
+                 backlog_threshold=0.5):
+        if not 0 < min_fps <= max_fps:
+            raise ValueError("Expected 0 < min_fps <= max_fps")
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.activity_threshold = activity_threshold
+        self.decay_seconds = decay_seconds
+        self.backlog_threshold = backlog_threshold
+        self.current_fps = min_fps
+        self._last_activity = None
+
+    def update(self, changed_fraction=None, tool_active=False, queue_fill=0.0):
+        """Feed the latest observations and return the next interval in seconds."""
+        now = time.monotonic()
+        if tool_active or (changed_fraction is not None and changed_fraction >= self.activity_threshold):
+            self._last_activity = now
+
+        if self._last_activity is None:
+            boost = 0.0
+        else:
+            boost = 0.5 ** ((now - self._last_activity) / self.decay_seconds)
+        fps = self.min_fps + (self.max_fps - self.min_fps) * boost
+
+        if queue_fill > self.backlog_threshold:
+            pressure = min(1.0, (queue_fill - self.backlog_threshold) / (1.0 - self.backlog_threshold))
+            fps -= (fps - self.min_fps) * pressure
+
+        self.current_fps = fps
+        return 1.0 / fps
+
+    def stats(self):
+        return {
+            "current_fps": round(self.current_fps, 3),
+            "min_fps": self.min_fps,
+            "max_fps": self.max_fps,
+        }
+
+
+# === Realtime uplink lanes ===
+AUDIO_LANE_MAXSIZE = 50         # ~3 s of mic chunks before the mic is back-pressured
+VIDEO_FRAME_MAX_AGE = 2.0       # seconds; older frames are dropped instead of sent
+
+
+class RealtimeLanes:
+    """
+    Outgoing realtime messages, split by lane instead of one FIFO.
+
+    - audio: FIFO with strict priority, bounded by audio_maxsize (put waits
+      when full, like asyncio.Queue).
+    - video: a single "latest frame" slot. A new frame replaces an unsent
+      one, and frames captured more than video_max_age ago are dropped at
+      dequeue (put() takes the capture time; it defaults to now).
+
+    Exposes put()/get()/qsize()/maxsize so it can stand in for the old
+    asyncio.Queue used as AudioLoop.out_queue.
+    """
+
+    def __init__(self, audio_maxsize=AUDIO_LANE_MAXSIZE, video_max_age=VIDEO_FRAME_MAX_AGE, tracer=None):
+        self.audio_maxsize = audio_maxsize
+        self.tracer = tracer
+        self.video_max_age = video_max_age
+        self._audio = deque()
+        self._video = None
+        self._ready = asyncio.Event()
+        self._audio_space = asyncio.Event()
+        self._audio_space.set()
+
+        self.audio_wait = LatencyStats()
+        self.video_wait = LatencyStats()
+        self.audio_max_depth = 0
+        self.video_replaced = 0
+        self.video_stale_dropped = 0
+
+    @property
+    def maxsize(self):
+        return self.audio_maxsize + 1
+
+    @staticmethod
+    def lane_of(msg):
+        return "video" if str(msg.get("mime_type", "")).startswith("image/") else "audio"
+
+    def qsize(self):
+        return len(self._audio) + (self._video is not None)
+
+    async def put(self, msg, captured_at=None):
+        now = time.monotonic()
+        if self.lane_of(msg) == "video":
+            if self._video is not None:
+                self.video_replaced += 1
+            self._video = (now, now if captured_at is None else captured_at, msg)
+            self._ready.set()
+            return
+
+        while len(self._audio) >= self.audio_maxsize:
+            self._audio_space.clear()
+            await self._audio_space.wait()
+        self._audio.append((time.monotonic(), msg))
+        self.audio_max_depth = max(self.audio_max_depth, len(self._audio))
+        self._ready.set()
+
+    async def get(self):
+        while True:
+            now = time.monotonic()
+            if self._audio:
+                queued_at, msg = self._audio.popleft()
+                self._audio_space.set()
+                self.audio_wait.add(now - queued_at)
+                if self.tracer is not None:
+                    self.tracer.record("uplink.queue_wait", queued_at, now, lane="audio")
+                return msg
+            if self._video is not None:
+                queued_at, captured_at, msg = self._video
+                self._video = None
+                if now - captured_at > self.video_max_age:
+                    self.video_stale_dropped += 1
+                    continue
+                self.video_wait.add(now - queued_at)
+                if self.tracer is not None:
+                    self.tracer.record("uplink.queue_wait", queued_at, now, lane="video")
+                return msg
+            self._ready.clear()
+            await self._ready.wait()
+
+    def stats(self):
+        return {
+            "audio_depth": len(self._audio),
+            "audio_max_depth": self.audio_max_depth,
+            "audio_wait": self.audio_wait.summary(),
+            "video_depth": int(self._video is not None),
+            "video_wait": self.video_wait.summary(),
+            "video_replaced": self.video_replaced,
+            "video_stale_dropped": self.video_stale_dropped,
+        }
+
+
+# === Audio ring buffers ===
+PLAYBACK_BUFFER_SECONDS = 60.0      # memory bound for model speech waiting to be played
+PLAYBACK_JITTER_MS = 80             # audio buffered before playback (re)starts
+PLAYBACK_FRAMES_PER_BUFFER = 480    # 20 ms at 24 kHz
+
+
+class PcmRingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring of int16 samples.
+
+    The producer only advances _write_pos and the consumer only advances
+    _read_pos, so with the GIL making each int store atomic neither side
+    needs a lock (the consumer is usually a PortAudio callback thread).
+    clear() is called from the producer side: it publishes _clear_pos,
+    which the consumer jumps to on its next read, so it is O(1).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._buf = np.zeros(self.capacity, dtype=np.int16)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._clear_pos = 0
+        self.dropped_samples = 0
+
+    def available(self):
+        """Samples ready for the consumer."""
+        return self._write_pos - max(self._read_pos, self._clear_pos)
+
+    def free(self):
+        """Samples the producer can write without overwriting unread data."""
+        return self.capacity - (self._write_pos - self._read_pos)
+
+    def write(self, samples):
+        """Copy samples in; whatever does not fit is dropped. Returns samples written."""
+        n = min(len(samples), self.free())
+        if n < len(samples):
+            self.dropped_samples += len(samples) - n
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = samples[:first]
+        self._buf[:n - first] = samples[first:n]
+        self._write_pos += n
+        return n
+
+    def skip_cleared(self):
+        """Consumer side: jump past data dropped by clear() so its space is freed."""
+        clear_pos = self._clear_pos
+        if clear_pos > self._read_pos:
+            self._read_pos = clear_pos
+
+    def read_into(self, out):
+        """Copy up to len(out) samples into out. Returns samples read."""
+        self.skip_cleared()
+        n = min(len(out), self._write_pos - self._read_pos)
+        start = self._read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        out[first:n] = self._buf[:n - first]
+        self._read_pos += n
+        return n
+
+    def clear(self):
+        """Drop everything written so far (producer side, O(1))."""
+        self._clear_pos = self._write_pos
+
+
+class AudioPlayback:
+    """
+    PyAudio callback-mode speaker output fed from a PcmRingBuffer.
+
+    Playback (re)starts once jitter_ms of audio is buffered, or once the
+    first pending sample has waited that long, so short replies still play.
+    Memory is bounded by buffer_seconds; chunks that do not fit are
+    dropped and counted as overruns. Running dry counts as an underrun
+    only while more audio of the reply is expected; the normal drain after
+    end_reply() or interrupt() is counted as a reply_drain instead.
+    """
+
+    def __init__(self, rate=RECEIVE_SAMPLE_RATE, buffer_seconds=PLAYBACK_BUFFER_SECONDS,
+                 jitter_ms=PLAYBACK_JITTER_MS, frames_per_buffer=PLAYBACK_FRAMES_PER_BUFFER):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.ring = PcmRingBuffer(int(rate * buffer_seconds))
+        self.jitter_samples = int(rate * jitter_ms / 1000)
+        self._out = np.zeros(frames_per_buffer, dtype=np.int16)
+        self._playing = False
+        self._pending_since = None
+        self._interrupted_at = None
+        self._reply_ended = True  # no model audio expected until the next write()
+        self.stream = None
+        self.first_played_at = None  # monotonic time playback first started (startup benchmark)
+
+        self.underruns = 0
+        self.reply_drains = 0
+        self.overruns = 0
+        self.device_underflows = 0
+        self.interruptions = 0
+        # Interrupt -> silence: time until the callback stops feeding buffered
+        # speech, plus the device output latency still queued in PortAudio.
+        self.interrupt_latency = LatencyStats()
+
+    def open(self, pa):
+        """Open the output stream on a PyAudio instance (blocking; call via to_thread)."""
+        self.stream = pa.open(
+            format=FORMAT,
+            channels=CHANNELS,
+            rate=self.rate,
+            output=True,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback,
+        )
+        return self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+    def write(self, data):
+        """Queue PCM bytes from the model for playback (event loop side)."""
+        samples = np.frombuffer(data, dtype=np.int16)
+        self._reply_ended = False
+        if self.ring.write(samples) < len(samples):
+            self.overruns += 1
+
+    def end_reply(self):
+        """The model finished its turn: the buffer running dry from now on is expected."""
+        self._reply_ended = True
+
+    def clear(self):
+        """Drop all buffered audio in O(1); silence starts at the next callback."""
+        self.ring.clear()
+
+    def interrupt(self):
+        """Barge-in: drop buffered speech now and time how long until it goes silent."""
+        self.interruptions += 1
+        self._reply_ended = True
+        self.ring.clear()
+        self._interrupted_at = time.perf_counter()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if status & PA_OUTPUT_UNDERFLOW:
+            self.device_underflows += 1
+        interrupted_at = self._interrupted_at
+        if interrupted_at is not None:
+            self._interrupted_at = None
+            self.ring.skip_cleared()
+            self._playing = False
+            self._pending_since = None
+            device_latency = self.stream.get_output_latency() if self.stream is not None else 0.0
+            self.interrupt_latency.add(time.perf_counter() - interrupted_at + device_latency)
+        if len(self._out) < frame_count:
+            self._out = np.zeros(frame_count, dtype=np.int16)
+        out = self._out[:frame_count]
+
+        if not self._playing:
+            available = self.ring.available()
+            now = time.monotonic()
+            if available == 0:
+                self._pending_since = None
+            elif self._pending_since is None:
+                self._pending_since = now
+            if available and (available >= self.jitter_samples
+                              or now - self._pending_since >= self.jitter_samples / self.rate):
+                self._playing = True
+                self._pending_since = None
+                if self.first_played_at is None:
+                    self.first_played_at = now
+
+        if self._playing:
+            n = self.ring.read_into(out)
+            if n < frame_count:
+                out[n:] = 0
+                if self._reply_ended:
+                    self.reply_drains += 1
+                else:
+                    self.underruns += 1
+                self._playing = False
+        else:
+            out[:] = 0
+        return out.tobytes(), PA_CONTINUE
+
+    def stats(self):
+        return {
+            "buffered_ms": round(self.ring.available() / self.rate * 1000, 1),
+            "jitter_target_ms": round(self.jitter_samples / self.rate * 1000, 1),
+            "underruns": self.underruns,
+            "reply_drains": self.reply_drains,
+            "overruns": self.overruns,
+            "dropped_ms": round(self.ring.dropped_samples / self.rate * 1000, 1),
+            "device_underflows": self.device_underflows,
+            "interruptions": self.interruptions,
+            "interrupt_to_silence": self.interrupt_latency.summary(),
+        }
+
+
+# === Microphone capture ===
+MIC_BATCH_MS = 100            # audio per uplink message
+MIC_BUFFER_SECONDS = 5.0      # capture backlog kept if the event loop stalls
+
+
+class MicCapture:
+    """
+    PyAudio callback-mode microphone capture into a PcmRingBuffer.
+
+    The PortAudio thread only copies samples into the ring; the event loop
+    is woken (call_soon_threadsafe) once a full batch of batch_ms is ready
+    and reads it with read_batch(). Overflows are counted, not hidden:
+    input_overflows are PortAudio-side, dropped samples are ring-side
+    (the event loop fell more than buffer_seconds behind).
+    """
+
+    def __init__(self, rate=SEND_SAMPLE_RATE, batch_ms=MIC_BATCH_MS, buffer_seconds=MIC_BUFFER_SECONDS,
+                 frames_per_buffer=CHUNK_SIZE):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.ring = PcmRingBuffer(int(rate * buffer_seconds))
+        self.batch_samples = int(rate * batch_ms / 1000)
+        self._batch = np.zeros(self.batch_samples, dtype=np.int16)
+        self._loop = None
+        self._data_ready = None
+        self._signalled = False
+        self.stream = None
+
+        self.input_overflows = 0
+        self.batches = 0
+
+    def open(self, pa, loop, input_device_index=None):
+        """Open the input stream (blocking; call via to_thread). loop is the reading event loop."""
+        self._loop = loop
+        self._data_ready = asyncio.Event()
+        self.stream = pa.open(
+            format=FORMAT,
+            channels=CHANNELS,
+            rate=self.rate,
+            input=True,
+            input_device_index=input_device_index,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback,
+        )
+        return self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if status & PA_INPUT_OVERFLOW:
+            self.input_overflows += 1
+        self.ring.write(np.frombuffer(in_data, dtype=np.int16))
+        if not self._signalled and self.ring.available() >= self.batch_samples:
+            self._signalled = True
+            self._loop.call_soon_threadsafe(self._data_ready.set)
+        return None, PA_CONTINUE
+
+    async def read_batch(self):
+        """Wait for and return the next batch_ms of PCM bytes."""
+        while self.ring.available() < self.batch_samples:
+            self._data_ready.clear()
+            self._signalled = False
+            # Re-check: the callback may have filled the batch before the flag reset
+            if self.ring.available() >= self.batch_samples:
+                break
+            await self._data_ready.wait()
+        n = self.ring.read_into(self._batch)
+        self.batches += 1
+        return self._batch[:n].tobytes()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "batch_ms": round(self.batch_samples / self.rate * 1000, 1),
+            "backlog_ms": round(self.ring.available() / self.rate * 1000, 1),
+            "input_overflows": self.input_overflows,
+            "dropped_ms": round(self.ring.dropped_samples / self.rate * 1000, 1),
+        }
+
+
+# === Voice activity gate ===
+# "activity": the local gate is the turn detector; it sends ActivityStart /
+#             ActivityEnd and server-side activity detection is disabled.
+# "stream_end": server-side detection stays on; the gate sends
+#             audio_stream_end when it closes.
+# "off": every mic batch is sent, as before.
+VAD_MODES = ("activity", "stream_end", "off")
+DEFAULT_VAD_MODE = "activity"
+VAD_FRAME_MS = 20
+VAD_ENERGY_DBFS = -45.0       # frames quieter than this are silence
+VAD_ZCR_MAX = 0.35            # frames crossing zero more often are noise/hiss, not voice
+VAD_MIN_VOICED_FRAMES = 2     # voiced frames needed in a batch to call it speech
+VAD_HANGOVER_MS = 600         # keep the gate open this long after the last speech
+VAD_PREROLL_MS = 300          # audio before the onset sent when the gate opens
+
+
+class VoiceActivityGate:
+    """
+    Energy + zero-crossing voice activity gate between the mic and the uplink.
+
+    Each batch is split into VAD_FRAME_MS frames and scored with numpy in
+    one pass. While closed, batches are kept in a pre-roll buffer so the
+    speech onset is not clipped; after the last speech the gate stays open
+    for the hangover period. process() returns the messages to send.
+    """
+
+    def __init__(self, rate=SEND_SAMPLE_RATE, mode=DEFAULT_VAD_MODE, frame_ms=VAD_FRAME_MS,
+                 energy_dbfs=VAD_ENERGY_DBFS, zcr_max=VAD_ZCR_MAX, min_voiced_frames=VAD_MIN_VOICED_FRAMES,
+                 hangover_ms=VAD_HANGOVER_MS, preroll_ms=VAD_PREROLL_MS):
+        if mode not in VAD_MODES:
+            raise ValueError(f"Unknown VAD mode '{mode}', choose from {VAD_MODES}")
+        self.rate = rate
+        self.mode = mode
+        self.frame_samples = int(rate * frame_ms / 1000)
+        self.energy_dbfs = energy_dbfs
+        self.zcr_max = zcr_max
+        self.min_voiced_frames = min_voiced_frames
+        self.hangover_samples = int(rate * hangover_ms / 1000)
+        self.preroll_samples = int(rate * preroll_ms / 1000)
+
+        self.is_open = False
+        self._preroll = deque()
+        self._preroll_len = 0
+        self._position = 0
+        self._last_speech = 0
+
+        self.total_samples = 0
+        self.suppressed_samples = 0
+        self.openings = 0
+
+    def is_speech(self, samples):
+        usable = len(samples) // self.frame_samples * self.frame_samples
+        if usable == 0:
+            return False
+        frames = samples[:usable].reshape(-1, self.frame_samples).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        dbfs = 20 * np.log10(rms / 32768.0 + 1e-9)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        voiced = (dbfs > self.energy_dbfs) & (zcr < self.zcr_max)
+        return int(np.count_nonzero(voiced)) >= self.min_voiced_frames
+
+    def process(self, data):
+        """Feed one PCM batch; return the list of uplink messages it produces."""
+        if self.mode == "off":
+            return [{"data": data, "mime_type": "audio/pcm"}]
+
+        samples = np.frombuffer(data, dtype=np.int16)
+        self.total_samples += len(samples)
+        self._position += len(samples)
+        speech = self.is_speech(samples)
+        if speech:
+            self._last_speech = self._position
+
+        if not self.is_open:
+            if not speech:
+                self._preroll.append(data)
+                self._preroll_len += len(samples)
+                while self._preroll and self._preroll_len - len(self._preroll[0]) // 2 >= self.preroll_samples:
+                    dropped = self._preroll.popleft()
+                    self._preroll_len -= len(dropped) // 2
+                    self.suppressed_samples += len(dropped) // 2
+                return []
+
+            self.is_open = True
+            self.openings += 1
+            messages = []
+            if self.mode == "activity":
+                messages.append({"control": {"activity_start": types.ActivityStart()}})
+            messages += [{"data": chunk, "mime_type": "audio/pcm"} for chunk in self._preroll]
+            messages.append({"data": data, "mime_type": "audio/pcm"})
+            self._preroll.clear()
+            self._preroll_len = 0
+            return messages
+
+        messages = [{"data": data, "mime_type": "audio/pcm"}]
+        if not speech and self._position - self._last_speech >= self.hangover_samples:
+            self.is_open = False
+            if self.mode == "activity":
+                messages.append({"control": {"activity_end": types.ActivityEnd()}})
+            else:
+                messages.append({"control": {"audio_stream_end": True}})
+        return messages
+
+    def live_config(self, config):
+        """Return the Live API config adjusted for this gate's signalling mode."""
+        if self.mode != "activity":
+            return config
+        return dict(config, realtime_input_config={"automatic_activity_detection": {"disabled": True}})
+
+    def stats(self):
+        suppressed = self.suppressed_samples + self._preroll_len
+        return {
+            "mode": self.mode,
+            "open": self.is_open,
+            "openings": self.openings,
+            "suppressed_fraction": round(suppressed / self.total_samples, 3) if self.total_samples else 0.0,
+            "suppressed_s": round(suppressed / self.rate, 1),
+        }
+
+
+class DesktopScreenSource:
+    """The real screen: the CaptureSelector's region, with the cursor mapped into it."""
+
+    def __init__(self, selector=None):
+        self.selector = selector or _CAPTURE_SELECTOR
+        self.region = None
+
+    def grab(self):
+        frame, self.region = self.selector.grab_bgra()
+        return frame
+
+    def cursor_position(self):
+        x, y = _MOUSE_CONTROLLER.position
+        return self.region.to_local(x, y) if self.region is not None else (int(x), int(y))
+
 
 class AudioLoop:
-    def __init__(self, video_mode=DEFAULT_MODE):
+    def __init__(self, video_mode=DEFAULT_MODE, encoder=DEFAULT_FRAME_ENCODER, quality=FRAME_QUALITY,
+                 max_frame_size=None, vad_mode=DEFAULT_VAD_MODE, trace_file=None, metrics_port=None,
+                 connect=None, audio_backend=None, screen_source=None, record_path=None):
         self.video_mode = video_mode
-
-        self.audio_in_queue = None
+        # Backends, swappable for offline runs (see FakeLiveSession and the
+        # Synthetic* classes): Live API connect, PyAudio-like audio, screen.
+        self.connect = connect
+        self.pa = audio_backend  # None: a real PyAudio instance is created in run()
+        self.screen_source = screen_source if screen_source is not None else DesktopScreenSource()
+        self.tracer = Tracer(trace_file)
+        self.recorder = SessionRecorder(record_path) if record_path else None
+        if self.recorder is not None:
+            self.tracer.on_span = self.recorder.span
+        self.metrics_port = metrics_port
+        # (monotonic time, kind) of the last request the model should answer;
+        # start point of the tool.arrival and audio.first_byte spans.
+        self._request_mark = None
+
+        self.playback = AudioPlayback()
+        self.mic = MicCapture()
+        self.vad = VoiceActivityGate(mode=vad_mode)
         self.out_queue = None
 
         self.session = None
@@ -752,6 +3489,17 @@ class AudioLoop:
         self.receive_audio_task = None
         self.play_audio_task = None
 
+        self.active_tool_calls = 0
+        self.tool_executor = ToolExecutor(tracer=self.tracer)
+        self.screen_change_detector = FrameChangeDetector()
+        self.cursor_sprite = None  # rendered on the first screen frame (needs cv2)
+        self.screen_rate = AdaptiveFrameRateController(SCREEN_MIN_FPS, SCREEN_MAX_FPS)
+        self.camera_rate = AdaptiveFrameRateController(CAMERA_MIN_FPS, CAMERA_MAX_FPS)
+        self.screen_encoder = make_frame_encoder(
+            encoder, quality=quality, max_size=max_frame_size or SCREEN_MAX_FRAME_SIZE)
+        self.camera_encoder = make_frame_encoder(
+            encoder, quality=quality, max_size=max_frame_size or CAMERA_MAX_FRAME_SIZE)
+
     async def send_text(self):
         while True:
             text = await asyncio.to_thread(
@@ -760,31 +3508,32 @@ class AudioLoop:
             )
             if text.lower() == "q":
                 break
-            await self.session.send_client_content(
-    turns=[{'role': 'user', 'parts': [{'text': text or "."}]}],
-    turn_complete=True
-)
+            await self.send_user_text(text)
+
+    async def send_user_text(self, text):
+        """Send one typed message as a complete user turn."""
+        await self.session.send_client_content(
+            turns=[{'role': 'user', 'parts': [{'text': text or "."}]}],
+            turn_complete=True
+        )
+        self._mark_request("text")
+        if self.recorder is not None:
+            self.recorder.text(text)
+
+    def _mark_request(self, kind):
+        self._request_mark = (time.monotonic(), kind)
 
     def _get_frame(self, cap):
         # Read the frameq
-        ret, frame = cap.read()
+        with self.tracer.span("capture", source="camera"):
+            ret, frame = cap.read()
         # Check if the frame was read successfully
         if not ret:
             return None
-        # Fix: Convert BGR to RGB color space
-        # OpenCV captures in BGR but PIL expects RGB format
-        # This prevents the blue tint in the video feed
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = PIL.Image.fromarray(frame_rgb)  # Now using RGB frame
-        img.thumbnail([1024, 1024])
-        
-        image_io = io.BytesIO()
-        img.save(image_io, format="jpeg", quality=85)
-        image_io.seek(0)
-
-        mime_type = "image/jpeg"
-        image_bytes = image_io.read()
-        return {"mime_type": mime_type, "data": base64.b64encode(image_bytes).decode()}
+        # The encoder takes OpenCV's BGR order directly (no RGB round trip)
+        # and caps the longest side at CAMERA_MAX_FRAME_SIZE.
+        with self.tracer.span("encode", source="camera"):
+            return self.camera_encoder.encode_message(frame)
 
     async def get_frames(self):
         # This takes about a second, and will block the whole program
@@ -794,13 +3543,19 @@ class AudioLoop:
         )  # 0 represents the default camera
 
         while True:
+            started = time.monotonic()
             frame = await asyncio.to_thread(self._get_frame, cap)
             if frame is None:
                 break
 
-            await asyncio.sleep(0.1)
+            # Queue the frame right away, then wait out the rest of the interval
+            await self.out_queue.put(frame, captured_at=started)
 
-            await self.out_queue.put(frame)
+            interval = self.camera_rate.update(
+                tool_active=self.active_tool_calls > 0,
+                queue_fill=self._out_queue_fill(),
+            )
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
 
         # Release the VideoCapture object
         cap.release()
@@ -809,86 +3564,84 @@ class AudioLoop:
 
     def _get_screen(self):
         """Capture screen and draw a custom visible cursor overlay."""
-        with mss.mss() as sct:
-            monitor = sct.monitors[0]
-
-            # Grab the screen
-            screenshot = sct.grab(monitor)
-
-            # Convert to a Pillow image
-            img = PIL.Image.frombytes("RGB", screenshot.size, screenshot.rgb)
-
-            # === Draw the cursor overlay ===
-            mx, my = pyautogui.position()
-            draw = ImageDraw.Draw(img)
-
-            # Choose cursor style
-            cursor_color = (255, 80, 0)  # Orange-red
-            ring_radius = 12
-            inner_radius = 4
-
-            # Glowing ring effect
-            for r in range(ring_radius + 6, ring_radius, -2):
-                draw.ellipse(
-                    (mx - r, my - r, mx + r, my + r),
-                    outline=(255, 120, 0),
-                    width=1
-                )
-
-            # Main cursor circle
-            draw.ellipse(
-                (mx - inner_radius, my - inner_radius, mx + inner_radius, my + inner_radius),
-                fill=cursor_color
-            )
+        # Grab the screen (zero-copy BGRA view)
+        with self.tracer.span("capture", source="screen"):
+            frame = self.screen_source.grab()
+
+        # Drop the frame early if nothing visible changed. The check runs on
+        # the raw grab, so the cursor position is passed in separately.
+        mx, my = self.screen_source.cursor_position()
+        if not self.screen_change_detector.check(frame, cursor=(mx, my)):
+            return None
 
-            # Optional: crosshair center
-            draw.line((mx - 6, my, mx + 6, my), fill=(255, 200, 0), width=2)
-            draw.line((mx, my - 6, mx, my + 6), fill=(255, 200, 0), width=2)
+        # === Blend the cursor overlay (in place, on the BGRA capture) ===
+        if not getattr(self.screen_source, "has_cursor", False):
+            if self.cursor_sprite is None:
+                self.cursor_sprite = CursorSprite()
+            self.cursor_sprite.blit(frame, mx, my)
 
-            # === Optimize for streaming ===
-            image_io = io.BytesIO()
-            img.save(image_io, format="JPEG", quality=85)
-            image_io.seek(0)
+        # === Optimize for streaming ===
+        with self.tracer.span("encode", source="screen") as span:
+            image_bytes = self.screen_encoder.encode(frame)
+            span["bytes"] = len(image_bytes)
+        self.screen_change_detector.record_sent(len(image_bytes))
 
-            return {
-                "mime_type": "image/jpeg",
-                "data": base64.b64encode(image_io.read()).decode(),
-            }
+        return {
+            "mime_type": self.screen_encoder.mime_type,
+            "data": base64.b64encode(image_bytes).decode(),
+        }
 
     async def get_screen(self):
 
         while True:
+            started = time.monotonic()
             frame = await asyncio.to_thread(self._get_screen)
-            if frame is None:
-                break
 
-            await asyncio.sleep(2.0)
+            # Queue the frame right away, then wait out the rest of the interval.
+            # None means the screen didn't change enough to be worth sending.
+            if frame is not None:
+                await self.out_queue.put(frame, captured_at=started)
 
-            await self.out_queue.put(frame)
+            interval = self.screen_rate.update(
+                changed_fraction=self.screen_change_detector.last_changed_fraction,
+                tool_active=self.active_tool_calls > 0,
+                queue_fill=self._out_queue_fill(),
+            )
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def _out_queue_fill(self):
+        """Fraction (0-1) of the outgoing realtime queue currently in use."""
+        if self.out_queue is None or not self.out_queue.maxsize:
+            return 0.0
+        return self.out_queue.qsize() / self.out_queue.maxsize
 
     async def send_realtime(self):
         while True:
             msg = await self.out_queue.get()
-            await self.session.send_realtime_input(media=msg)
+            if self.recorder is not None:
+                self.recorder.uplink(msg)
+            if "control" in msg:
+                # Activity signals from the voice gate
+                with self.tracer.span("uplink.send", lane="control"):
+                    await self.session.send_realtime_input(**msg["control"])
+                if "activity_end" in msg["control"] or "audio_stream_end" in msg["control"]:
+                    self._mark_request("speech_end")
+            else:
+                with self.tracer.span("uplink.send", lane=self.out_queue.lane_of(msg)):
+                    await self.session.send_realtime_input(media=msg)
 
     async def listen_audio(self):
-        mic_info = pya.get_default_input_device_info()
+        mic_info = self.pa.get_default_input_device_info()
         self.audio_stream = await asyncio.to_thread(
-            pya.open,
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=SEND_SAMPLE_RATE,
-            input=True,
-            input_device_index=mic_info["index"],
-            frames_per_buffer=CHUNK_SIZE,
+            self.mic.open, self.pa, asyncio.get_running_loop(), mic_info["index"]
         )
-        if __debug__:
-            kwargs = {"exception_on_overflow": False}
-        else:
-            kwargs = {}
-        while True:
-            data = await asyncio.to_thread(self.audio_stream.read, CHUNK_SIZE, **kwargs)
-            await self.out_queue.put({"data": data, "mime_type": "audio/pcm"})
+        try:
+            while True:
+                data = await self.mic.read_batch()
+                for msg in self.vad.process(data):
+                    await self.out_queue.put(msg)
+        finally:
+            self.mic.close()
 
     async def receive_audio(self,tg: asyncio.TaskGroup,session):
         "Background task to reads from the websocket and write pcm chunks to the output queue"
@@ -897,20 +3650,41 @@ class AudioLoop:
             response = None
             try:
                 async for response in turn:
+                    if self.recorder is not None:
+                        self.recorder.downlink(response)
+                    # Barge-in: the user talked over the model. Silence the
+                    # speaker right away instead of after the turn ends.
+                    if response.server_content and response.server_content.interrupted:
+                        self.playback.interrupt()
+                        print(response)
+                        continue
                     if data := response.data:
-                        self.audio_in_queue.put_nowait(data)
+                        if self._request_mark is not None:
+                            marked_at, kind = self._request_mark
+                            self._request_mark = None
+                            self.tracer.record("audio.first_byte", marked_at, time.monotonic(), after=kind)
+                        self.playback.write(data)
                         continue
                     elif text := response.text:
                         print(text, end="")
                     elif tool_call := response.tool_call:
-                        await self.handle_tool_call(session, tool_call)
+                        if self._request_mark is not None:
+                            marked_at, kind = self._request_mark
+                            self.tracer.record("tool.arrival", marked_at, time.monotonic(), after=kind,
+                                               calls=[fc.name for fc in tool_call.function_calls or []])
+                        # Run tools as their own task so this reader keeps
+                        # draining audio (and cancellations) meanwhile.
+                        tg.create_task(self.handle_tool_call(session, tool_call))
+                    elif cancellation := response.tool_call_cancellation:
+                        print("Tool call cancellation: ", cancellation)
+                        self.tool_executor.cancel(cancellation.ids)
                     elif setup_complete := response.setup_complete:
                         print(response)
                     elif turn_complete := response.server_content.turn_complete:
+                        self.playback.end_reply()
                         print(response)
                     elif generation_complete := response.server_content.generation_complete:
-                        print(response)
-                    elif response_complete := response.server_content.interrupted:
+                        self.playback.end_reply()
                         print(response)
                     elif len(response.server_content.model_turn.parts) > 0:
                         print(response)
@@ -920,59 +3694,79 @@ class AudioLoop:
             except Exception as e:
                 print("Response: ", response)
                 print('>>> Error: ', e)
-                        
-            while not self.audio_in_queue.empty():
-                self.audio_in_queue.get_nowait()
+            # receive() ends with the turn, so its audio has fully arrived
+            self.playback.end_reply()
 
     async def play_audio(self):
-        stream = await asyncio.to_thread(
-            pya.open,
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=RECEIVE_SAMPLE_RATE,
-            output=True,
-        )
-        while True:
-            bytestream = await self.audio_in_queue.get()
-            await asyncio.to_thread(stream.write, bytestream)
+        # PortAudio pulls from the ring buffer in its own callback thread,
+        # so there is no per-chunk thread hop; this task only owns the stream.
+        await asyncio.to_thread(self.playback.open, self.pa)
+        try:
+            await asyncio.Future()
+        finally:
+            self.playback.close()
 
         
     async def handle_tool_call(self, session, tool_call):
         print("Tool call: ", tool_call)
-        function_responses = []
-        for fc in tool_call.function_calls:
-            try:
-                result = func_names_dict[fc.name](**fc.args)
-                function_responses.append(types.FunctionResponse(
-                    id=fc.id,
-                    name=fc.name,
-                    response=result,
-                ))
-            except Exception as e:
-                print(f"❌ Tool {fc.name} failed: {e}")
-                function_responses.append(types.FunctionResponse(
-                    id=fc.id,
-                    name=fc.name,
-                    response={"error": str(e)},
-                ))
-        
-        await session.send_tool_response(function_responses=function_responses)
-        
+        self.active_tool_calls += 1
+        try:
+            await self._run_tool_calls(session, tool_call)
+        finally:
+            self.active_tool_calls -= 1
+
+    async def _run_tool_calls(self, session, tool_call):
+        started = time.monotonic()
+        function_responses = await self.tool_executor.run_all(tool_call.function_calls)
+        if any(fc.name in INPUT_TOOLS for fc in tool_call.function_calls):
+            # Always stream the screen right after input, even if it barely changed
+            self.screen_change_detector.reset()
+        if self.recorder is not None:
+            self.recorder.tool_results(function_responses, time.monotonic() - started)
+        try:
+            with self.tracer.span("tool.response_send", calls=len(function_responses)):
+                await session.send_tool_response(function_responses=function_responses)
+        except Exception as e:
+            print('>>> Error sending tool response: ', e)
+            return
+        self._mark_request("tool_response")
+
         # Small delay to prevent race conditions
         await asyncio.sleep(0.05)
         # await session.send_client_event(event_type="turn_complete")
-    async def run(self):
+    async def warm_up_vision_client(self):
+        """Open the pooled connection used by the vision tools before the first tool call."""
+        started = time.perf_counter()
+        try:
+            await get_client().aio.models.get(model=VISION_MODEL)
+            print(f"[LOG] Vision client warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+        except Exception as e:
+            print(f"[LOG] Vision client warm-up failed: {e}")
+
+    async def run(self, until=None):
+        """
+        Run the session until the user types "q", or until the awaitable
+        `until` completes when given (offline benchmarks; no console input).
+        """
+        # Devices and the API client are only created here, not at import.
+        connect = self.connect or get_client().aio.live.connect
+        owns_audio = self.pa is None
+        if owns_audio:
+            self.pa = await asyncio.to_thread(pyaudio.PyAudio)
         try:
             async with (
-                client.aio.live.connect(model=MODEL, config=CONFIG) as session,
+                connect(model=MODEL, config=self.vad.live_config(build_config())) as session,
                 asyncio.TaskGroup() as tg,
             ):
                 self.session = session
 
-                self.audio_in_queue = asyncio.Queue()
-                self.out_queue = asyncio.Queue(maxsize=5)
+                self.out_queue = RealtimeLanes(tracer=self.tracer)
 
-                send_text_task = tg.create_task(self.send_text())
+                if self.connect is None:
+                    tg.create_task(self.warm_up_vision_client())
+                if self.metrics_port:
+                    tg.create_task(self.tracer.serve_metrics(self.metrics_port))
+                send_text_task = tg.create_task(self.send_text() if until is None else until)
                 tg.create_task(self.send_realtime())
                 tg.create_task(self.listen_audio())
                 if self.video_mode == "camera":
@@ -989,9 +3783,814 @@ class AudioLoop:
         except asyncio.CancelledError:
             pass
         except ExceptionGroup as EG:
-            self.audio_stream.close()
+            self.mic.close()
             traceback.print_exception(EG)
+        finally:
+            self.tool_executor.shutdown()
+            if owns_audio:
+                self.pa.terminate()
+                self.pa = None
+            print("📊 Session stats:", self.stats())
+            self.tracer.close()
+            if self.recorder is not None:
+                self.recorder.close()
+
+    def stats(self):
+        """Collect the performance counters of the streaming pipeline."""
+        return {
+            "screen": self.screen_change_detector.stats(),
+            "screen_rate": self.screen_rate.stats(),
+            "camera_rate": self.camera_rate.stats(),
+            "uplink": self.out_queue.stats() if self.out_queue is not None else {},
+            "tools": self.tool_executor.stats(),
+            "screenshot_archive": _SCREENSHOT_ARCHIVER.stats(),
+            "detection_cache": _DETECTION_CACHE.stats(),
+            "vision_http": _VISION_HTTP_STATS.summary(),
+            "playback": self.playback.stats(),
+            "mic": self.mic.stats(),
+            "vad": self.vad.stats(),
+            "capture": _CAPTURE_SELECTOR.stats(),
+            "cursor": self.cursor_sprite.stats() if self.cursor_sprite is not None else None,
+            "mouse_motion": _MOUSE_MOTION.stats(),
+            "text_entry": _TEXT_ENTRY.stats(),
+            "trace": self.tracer.summary(),
+            "recording": self.recorder.stats() if self.recorder is not None else None,
+        }
+
+
+
+# === Offline session stand-ins ===
+# Replace the Live API, microphone/speaker, screen and mouse/keyboard so an
+# AudioLoop can run headless with no network (benchmarks, CI).
+FAKE_AUDIO_CHUNK_MS = 40
+FAKE_TOOL_RESPONSE_TIMEOUT = 30.0
+SYNTHETIC_SCREEN_SIZE = (1920, 1080)
+SYNTHETIC_TALK_SECONDS = 1.5
+SYNTHETIC_PAUSE_SECONDS = 2.0
+LOOP_LAG_INTERVAL = 0.01
+
+
+def make_fake_script(turns=5, audio_seconds=2.0, chunk_ms=FAKE_AUDIO_CHUNK_MS, tool_calls=1,
+                     tool_name="move_mouse_absolute", tool_args=None, interrupt_every=0, think_seconds=0.3):
+    """
+    Build a FakeLiveSession script: each turn optionally makes tool_calls
+    calls, streams audio_seconds of reply audio in chunk_ms chunks (real-time
+    paced) and completes. Every interrupt_every-th turn is cut off halfway
+    by an interruption.
+    """
+    script = []
+    chunks = max(1, int(audio_seconds * 1000 / chunk_ms))
+    for turn in range(turns):
+        script.append({"type": "wait", "seconds": think_seconds})
+        if tool_calls:
+            script.append({"type": "tool_call",
+                           "calls": [{"name": tool_name, "args": dict(tool_args or {"x": 400, "y": 300})}
+                                     for _ in range(tool_calls)]})
+        interrupted = interrupt_every and (turn + 1) % interrupt_every == 0
+        for i in range(chunks // 2 if interrupted else chunks):
+            script.append({"type": "audio", "ms": chunk_ms, "delay": chunk_ms / 1000})
+        script.append({"type": "interrupted"} if interrupted else {"type": "turn_complete"})
+    return script
+
+
+def _fake_audio_message(ms, rate=RECEIVE_SAMPLE_RATE):
+    pcm = np.zeros(int(rate * ms / 1000), dtype=np.int16).tobytes()
+    return types.LiveServerMessage(server_content=types.LiveServerContent(model_turn=types.Content(
+        role="model", parts=[types.Part(inline_data=types.Blob(data=pcm, mime_type=f"audio/pcm;rate={rate}"))])))
+
+
+class FakeLiveSession:
+    """
+    Stand-in for the session yielded by client.aio.live.connect.
+
+    Replays a script (see make_fake_script) as LiveServerMessages: "audio"
+    chunks, "tool_call"s (the script then waits for send_tool_response, like
+    the model does), "interrupted", "turn_complete", prebuilt "message"s and
+    "wait" pauses. Events with an "at" offset are sent no earlier than that.
+    Uplink calls are counted instead of sent. Use session.connect as the
+    AudioLoop connect backend and session.finished to stop the run.
+    """
+
+    def __init__(self, script, tool_response_timeout=FAKE_TOOL_RESPONSE_TIMEOUT):
+        self.script = list(script)
+        self.tool_response_timeout = tool_response_timeout
+        self.finished = asyncio.Event()
+        self._messages = asyncio.Queue()
+        self._tool_responses = {}
+        self._player = None
+        self._call_counter = 0
+        self.started_at = None
+
+        self.uplink = {"audio": 0, "video": 0, "control": 0, "text": 0, "tool_response": 0}
+        self.uplink_bytes = 0
+        self.downlink_audio_bytes = 0
+        self.tool_round_trip = LatencyStats()
+        self.tool_timeouts = 0
+
+    @contextlib.asynccontextmanager
+    async def connect(self, model=None, config=None):
+        self.started_at = time.monotonic()
+        self._player = asyncio.create_task(self._play())
+        try:
+            yield self
+        finally:
+            self._player.cancel()
+            await asyncio.gather(self._player, return_exceptions=True)
+
+    async def _play(self):
+        try:
+            for event in self.script:
+                kind = event["type"]
+                if "at" in event:
+                    # Absolute schedule (replays); late events go out right away
+                    delay = self.started_at + event["at"] - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if kind == "wait":
+                    await asyncio.sleep(event["seconds"])
+                elif kind == "audio":
+                    message = _fake_audio_message(event["ms"])
+                    self.downlink_audio_bytes += len(message.data)
+                    await self._messages.put(message)
+                    await asyncio.sleep(event.get("delay", 0))
+                elif kind == "tool_call":
+                    await self._tool_call(event["calls"])
+                elif kind == "interrupted":
+                    await self._messages.put(types.LiveServerMessage(
+                        server_content=types.LiveServerContent(interrupted=True, turn_complete=True)))
+                elif kind == "turn_complete":
+                    await self._messages.put(types.LiveServerMessage(
+                        server_content=types.LiveServerContent(turn_complete=True)))
+                elif kind == "message":
+                    message = event["message"]
+                    self.downlink_audio_bytes += len(message.data or b"")
+                    await self._messages.put(message)
+                else:
+                    raise ValueError(f"Unknown fake script event '{kind}'")
+        finally:
+            self.finished.set()
+
+    async def _tool_call(self, calls):
+        function_calls = []
+        for call in calls:
+            self._call_counter += 1
+            function_calls.append(types.FunctionCall(
+                id=call.get("id") or f"fake-{self._call_counter}", name=call["name"], args=call.get("args") or {}))
+        waiters = {fc.id: asyncio.get_running_loop().create_future() for fc in function_calls}
+        self._tool_responses.update(waiters)
+        started = time.monotonic()
+        await self._messages.put(types.LiveServerMessage(
+            tool_call=types.LiveServerToolCall(function_calls=function_calls)))
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiters.values()), self.tool_response_timeout)
+            self.tool_round_trip.add(time.monotonic() - started)
+        except asyncio.TimeoutError:
+            self.tool_timeouts += 1
+        finally:
+            for call_id in waiters:
+                self._tool_responses.pop(call_id, None)
+
+    async def receive(self):
+        """Yield messages until the end of the current turn, like the real session."""
+        while True:
+            message = await self._messages.get()
+            yield message
+            if message.server_content and message.server_content.turn_complete:
+                return
+
+    async def send_realtime_input(self, media=None, **control):
+        if media is None:
+            self.uplink["control"] += 1
+            return
+        lane = "video" if str(media.get("mime_type", "")).startswith("image/") else "audio"
+        self.uplink[lane] += 1
+        self.uplink_bytes += len(media.get("data", b""))
+
+    async def send_client_content(self, turns=None, turn_complete=True):
+        self.uplink["text"] += 1
+
+    async def send_tool_response(self, function_responses):
+        self.uplink["tool_response"] += 1
+        for response in function_responses:
+            waiter = self._tool_responses.get(response.id)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(response)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9) if self.started_at else 0.0
+        return {
+            "duration_s": round(elapsed, 2),
+            "uplink": dict(self.uplink),
+            "uplink_kbps": round(self.uplink_bytes * 8 / 1000 / elapsed, 1) if elapsed else 0.0,
+            "uplink_msgs_per_s": round(sum(self.uplink.values()) / elapsed, 1) if elapsed else 0.0,
+            "downlink_audio_s": round(self.downlink_audio_bytes / 2 / RECEIVE_SAMPLE_RATE, 2),
+            "tool_round_trip": self.tool_round_trip.summary(),
+            "tool_timeouts": self.tool_timeouts,
+        }
+
+
+class _SyntheticStream:
+    """PyAudio callback stream driven by a thread at real-time pace."""
+
+    def __init__(self, backend, rate, frames_per_buffer, stream_callback, is_input):
+        self.backend = backend
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.callback = stream_callback
+        self.is_input = is_input
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="synthetic-mic" if is_input else "synthetic-speaker")
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._pump()
+        except BaseException as e:
+            # Keep it for SyntheticAudioBackend.raise_errors(); a dead device
+            # thread must fail the run, not just leave silence behind.
+            self.backend.errors.append(e)
+            print(f"[BENCH] {self._thread.name} thread failed: {e!r}")
+
+    def _pump(self):
+        period = self.frames_per_buffer / self.rate
+        next_at = time.perf_counter()
+        position = 0
+        while not self._stop.is_set():
+            if self.is_input:
+                in_data = self.backend.mic_signal(position, self.frames_per_buffer)
+                self.callback(in_data, self.frames_per_buffer, {}, 0)
+                self.backend.mic_frames += self.frames_per_buffer
+            else:
+                out_data, _ = self.callback(None, self.frames_per_buffer, {}, 0)
+                self.backend.speaker_frames += self.frames_per_buffer
+                self.backend.speaker_nonsilent_frames += int(np.count_nonzero(
+                    np.frombuffer(out_data, dtype=np.int16)))
+            position += self.frames_per_buffer
+            next_at += period
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                self.backend.late_callbacks += 1
+
+    def get_output_latency(self):
+        return 0.0
+
+    def stop_stream(self):
+        self._stop.set()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+
+class SyntheticAudioBackend:
+    """
+    PyAudio stand-in. The mic plays talk_seconds of a voiced two-tone signal
+    (loud enough to open the voice gate), then pause_seconds of silence, in
+    a loop; the speaker discards output but counts it.
+    """
+
+    def __init__(self, talk_seconds=SYNTHETIC_TALK_SECONDS, pause_seconds=SYNTHETIC_PAUSE_SECONDS,
+                 amplitude=6000):
+        self.talk_seconds = talk_seconds
+        self.pause_seconds = pause_seconds
+        self.amplitude = amplitude
+        self.mic_frames = 0
+        self.speaker_frames = 0
+        self.speaker_nonsilent_frames = 0
+        self.late_callbacks = 0
+        self.errors = []
+
+    def raise_errors(self):
+        """Re-raise the first exception from a stream thread, if any."""
+        if self.errors:
+            raise RuntimeError(f"synthetic audio stream failed: {self.errors[0]!r}") from self.errors[0]
+
+    def get_default_input_device_info(self):
+        return {"index": 0, "name": "synthetic"}
+
+    def open(self, format=None, channels=1, rate=SEND_SAMPLE_RATE, input=False, output=False,
+             frames_per_buffer=CHUNK_SIZE, stream_callback=None, input_device_index=None):
+        return _SyntheticStream(self, rate, frames_per_buffer, stream_callback, is_input=input)
+
+    def mic_signal(self, position, frame_count, rate=SEND_SAMPLE_RATE):
+        t = (position + np.arange(frame_count)) / rate
+        cycle = self.talk_seconds + self.pause_seconds
+        talking = (t % cycle) < self.talk_seconds
+        voice = np.sin(2 * np.pi * 180 * t) + 0.5 * np.sin(2 * np.pi * 720 * t)
+        return (voice * self.amplitude * talking).astype(np.int16).tobytes()
+
+    def terminate(self):
+        pass
+
+    def stats(self):
+        return {
+            "mic_s": round(self.mic_frames / SEND_SAMPLE_RATE, 2),
+            "speaker_s": round(self.speaker_frames / RECEIVE_SAMPLE_RATE, 2),
+            "late_callbacks": self.late_callbacks,
+        }
+
+
+class SyntheticScreenSource:
+    """Synthetic desktop whose cursor moves and a small "typing" region changes on every grab."""
+
+    def __init__(self, width=SYNTHETIC_SCREEN_SIZE[0], height=SYNTHETIC_SCREEN_SIZE[1], seed=0):
+        self.base = synthetic_desktop_frame(width, height, seed)
+        self.frame = self.base.copy()
+        self.width = width
+        self.height = height
+        self.grabs = 0
+
+    def grab(self):
+        self.grabs += 1
+        # Restore the last region and draw a new one, like a line of typed text
+        y = 40 + (self.grabs * 18) % (self.height - 80)
+        self.frame[:] = self.base
+        self.frame[y:y + 12, 40:40 + 8 * (self.grabs % 60 + 1)] = (20, 20, 20, 255)
+        return self.frame
+
+    def cursor_position(self):
+        return ((self.grabs * 37) % self.width, (self.grabs * 23) % self.height)
+
+
+class SyntheticInput:
+    """pynput-like mouse and keyboard controller that only counts events."""
+
+    def __init__(self):
+        self._position = (0, 0)
+        self.events = {}
+
+    def _count(self, name):
+        self.events[name] = self.events.get(name, 0) + 1
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._count("move")
+        self._position = value
+
+    def press(self, key):
+        self._count("press")
+
+    def release(self, key):
+        self._count("release")
+
+    def click(self, button, count=1):
+        self._count("click")
+
+    def scroll(self, dx, dy):
+        self._count("scroll")
+
+    def type(self, text):
+        self._count("type")
 
+    @contextlib.contextmanager
+    def pressed(self, *keys):
+        self._count("press")
+        yield
+        self._count("release")
+
+
+def install_input_backend(mouse_controller, keyboard_controller):
+    """Point every mouse/keyboard tool at the given controllers. Returns the previous pair."""
+    global _MOUSE_CONTROLLER, _KEYBOARD_CONTROLLER
+    previous = (_MOUSE_CONTROLLER, _KEYBOARD_CONTROLLER)
+    _MOUSE_CONTROLLER = mouse_controller
+    _KEYBOARD_CONTROLLER = keyboard_controller
+    _MOUSE_MOTION.controller = mouse_controller
+    _TEXT_ENTRY.controller = keyboard_controller
+    return previous
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes a sleep(interval) - the lag every other task sees."""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lag = LatencyStats()
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag.add(max(0.0, time.perf_counter() - started - self.interval))
+
+
+async def run_offline_session(session, video_mode="none", screen_source=None, audio=None, texts=(),
+                              **loop_kwargs):
+    """
+    Run an AudioLoop on `session` (a FakeLiveSession) with the synthetic
+    audio and input backends until its script ends. audio replaces the
+    synthetic mic/speaker; texts is a list of (seconds, text) typed
+    messages sent at those offsets from the session start. Returns the loop
+    plus the measurements taken around it.
+    """
+    audio = audio or SyntheticAudioBackend()
+    synthetic_input = SyntheticInput()
+    previous_input = install_input_backend(synthetic_input, synthetic_input)
+    agent = AudioLoop(video_mode=video_mode, connect=session.connect, audio_backend=audio,
+                      screen_source=screen_source or SyntheticScreenSource(), **loop_kwargs)
+
+    lag = EventLoopLagMonitor()
+    queue_depth = LatencyStats()  # reused as a plain distribution (values are message counts)
+    playback_buffered_ms = LatencyStats()
+
+    async def sample_depths():
+        while True:
+            await asyncio.sleep(0.05)
+            if agent.out_queue is not None:
+                queue_depth.add(agent.out_queue.qsize())
+            playback_buffered_ms.add(agent.playback.ring.available() / agent.playback.rate * 1000)
+
+    async def send_texts():
+        while agent.session is None:
+            await asyncio.sleep(0.01)
+        started = time.monotonic()
+        for offset, text in texts:
+            await asyncio.sleep(max(0.0, offset - (time.monotonic() - started)))
+            await agent.send_user_text(text)
+
+    monitors = [asyncio.create_task(lag.run()), asyncio.create_task(sample_depths())]
+    if texts:
+        monitors.append(asyncio.create_task(send_texts()))
+    async def until_finished():
+        # Also stops the run early when a synthetic device thread died
+        while not session.finished.is_set():
+            audio.raise_errors()
+            await asyncio.sleep(0.05)
+
+    try:
+        await agent.run(until=until_finished())
+    finally:
+        for task in monitors:
+            task.cancel()
+        await asyncio.gather(*monitors, return_exceptions=True)
+        install_input_backend(*previous_input)
+    audio.raise_errors()
+
+    return agent, {
+        "session": session.stats(),
+        "audio_devices": audio.stats(),
+        "input_events": synthetic_input.events,
+        "out_queue_depth": {"mean": round(queue_depth.total / queue_depth.count, 2) if queue_depth.count else 0,
+                            "p95": queue_depth.percentile(95), "max": queue_depth.max},
+        "playback_buffered_ms": {"p50": round(playback_buffered_ms.percentile(50), 1),
+                                 "max": round(playback_buffered_ms.max, 1)},
+        "event_loop_lag": lag.lag.summary(),
+    }
+
+
+async def benchmark_session(video_mode="screen", turns=5, tool_calls=1, interrupt_every=0,
+                            audio_seconds=2.0, vad_mode=DEFAULT_VAD_MODE, encoder=DEFAULT_FRAME_ENCODER):
+    """
+    Run a full AudioLoop against FakeLiveSession and the synthetic backends
+    (no network, devices or display input). Reports throughput, queue
+    depths, tool-call latency and event-loop lag.
+    """
+    if video_mode == "camera":
+        raise ValueError("benchmark_session has no synthetic camera; use --mode screen or none")
+    session = FakeLiveSession(make_fake_script(turns=turns, audio_seconds=audio_seconds, tool_calls=tool_calls,
+                                               interrupt_every=interrupt_every))
+    agent, result = await run_offline_session(session, video_mode=video_mode, vad_mode=vad_mode, encoder=encoder)
+    pipeline = agent.stats()
+    result["tools"] = pipeline["tools"]["per_tool"]
+    result["trace"] = pipeline["trace"]
+    for key, value in result.items():
+        print(f"[BENCH] {key}: {value}")
+    return result
+
+
+# === Startup benchmark ===
+STARTUP_BENCH_MODES = ("none", "screen", "camera")
+STARTUP_BENCH_RUNS = 3
+STARTUP_PROBE_TIMEOUT = 60.0
+
+
+async def startup_probe(video_mode, synthetic_devices=False):
+    """
+    Child side of benchmark_startup: start a session against a
+    FakeLiveSession that answers with audio right away and print wall-clock
+    timestamps for "main entered" and "first audio played" as JSON.
+    """
+    main_entered = time.time()
+    session = FakeLiveSession([{"type": "audio", "ms": FAKE_AUDIO_CHUNK_MS, "delay": FAKE_AUDIO_CHUNK_MS / 1000}
+                               for _ in range(10)] + [{"type": "turn_complete"}])
+    audio = SyntheticAudioBackend() if synthetic_devices else None
+    agent = AudioLoop(video_mode=video_mode, connect=session.connect, audio_backend=audio)
+
+    async def first_audio():
+        while agent.playback.first_played_at is None:
+            if audio is not None:
+                audio.raise_errors()
+            await asyncio.sleep(0.002)
+
+    await agent.run(until=first_audio())
+    first_played_at = agent.playback.first_played_at
+    print("[STARTUP] " + json.dumps({
+        "main_entered": main_entered,
+        "first_audio": None if first_played_at is None else time.time() - (time.monotonic() - first_played_at),
+    }))
+
+
+def benchmark_startup(modes=STARTUP_BENCH_MODES, runs=STARTUP_BENCH_RUNS, synthetic_devices=False):
+    """
+    Time-to-first-audio per --mode, each in a fresh interpreter: process
+    start -> module imported and main entered -> first audio played. Uses a
+    FakeLiveSession, so the network connect is not included.
+    """
+    import subprocess
+
+    summary = {}
+    for mode in modes:
+        to_main, to_audio = LatencyStats(), LatencyStats()
+        for _ in range(runs):
+            command = [sys.executable, os.path.abspath(__file__), "--startup-probe", "--mode", mode]
+            if synthetic_devices:
+                command.append("--synthetic-devices")
+            spawned = time.time()
+            try:
+                proc = subprocess.run(command, capture_output=True, text=True, timeout=STARTUP_PROBE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                print(f"[BENCH] {mode}: probe timed out after {STARTUP_PROBE_TIMEOUT:.0f}s")
+                continue
+            lines = [line for line in proc.stdout.splitlines() if line.startswith("[STARTUP] ")]
+            if proc.returncode != 0 or not lines:
+                print(f"[BENCH] {mode}: probe failed ({proc.stderr.strip().splitlines()[-1:]})")
+                continue
+            result = json.loads(lines[-1][len("[STARTUP] "):])
+            to_main.add(result["main_entered"] - spawned)
+            if result["first_audio"] is not None:
+                to_audio.add(result["first_audio"] - spawned)
+        summary[mode] = {"import_and_main": to_main.summary(), "first_audio": to_audio.summary()}
+        print(f"[BENCH] {mode}: import+main p50 {summary[mode]['import_and_main']['p50_ms']} ms, "
+              f"first audio p50 {summary[mode]['first_audio']['p50_ms']} ms ({to_audio.count}/{runs} runs)")
+    return summary
+
+
+# === Session recording ===
+# File layout: RECORDING_MAGIC, then records of
+#   RECORD_HEADER (offset seconds since start, kind, JSON length, blob length)
+#   JSON metadata, raw blob bytes (PCM audio, encoded frames).
+# Records are only ever appended; a truncated tail (crash) is ignored on read.
+RECORDING_MAGIC = b"DAREC\x01"
+RECORD_HEADER = struct.Struct("<dBII")
+RECORD_KINDS = ("uplink", "downlink", "tool_result", "span")
+REPLAY_REGRESSION_TOLERANCE = 0.25  # flag stages whose p50/p95 grew more than this
+REPLAY_MAX_FRAMES = 64  # recorded screen frames kept decoded during a replay
+
+
+def _model_turn_parts(message):
+    content = message.server_content
+    if content is None or content.model_turn is None:
+        return []
+    return content.model_turn.parts or []
+
+
+class SessionRecorder:
+    """
+    Appends Live API traffic, tool results and trace spans to a recording
+    (see RECORD_HEADER). Audio and frames are stored as raw bytes, not
+    base64 JSON. Safe to call from worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(RECORDING_MAGIC)
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.records = 0
+        self.bytes_written = len(RECORDING_MAGIC)
+        self._write("uplink", {"start": True, "wall_time": time.time(), "model": MODEL})
+
+    def _write(self, kind, meta, blob=b"", at=None):
+        offset = (time.monotonic() if at is None else at) - self.started
+        meta_bytes = json.dumps(meta, separators=(",", ":"), default=str).encode()
+        header = RECORD_HEADER.pack(offset, RECORD_KINDS.index(kind), len(meta_bytes), len(blob))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(header + meta_bytes + blob)
+            self.records += 1
+            self.bytes_written += len(header) + len(meta_bytes) + len(blob)
+
+    def uplink(self, msg):
+        if "control" in msg:
+            self._write("uplink", {"control": sorted(msg["control"])})
+            return
+        data = msg.get("data", b"")
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        self._write("uplink", {"lane": RealtimeLanes.lane_of(msg), "mime_type": msg.get("mime_type")}, data)
+
+    def text(self, text):
+        self._write("uplink", {"text": text})
+
+    def downlink(self, message):
+        """Record a LiveServerMessage; inline audio goes to the blob."""
+        parts = [part for part in _model_turn_parts(message) if part.inline_data and part.inline_data.data]
+        blobs = [part.inline_data.data for part in parts]
+        for part in parts:
+            part.inline_data.data = None
+        try:
+            meta = message.model_dump(mode="json", exclude_none=True)
+        finally:
+            for part, blob in zip(parts, blobs):
+                part.inline_data.data = blob
+        if blobs:
+            meta["_blob_sizes"] = [len(blob) for blob in blobs]
+        self._write("downlink", meta, b"".join(blobs))
+
+    def tool_results(self, function_responses, seconds):
+        self._write("tool_result", {
+            "seconds": round(seconds, 6),
+            "responses": [{"id": r.id, "name": r.name, "response": r.response} for r in function_responses],
+        })
+
+    def span(self, stage, start, end, attrs):
+        self._write("span", {"stage": stage, "duration": round(end - start, 6)}, at=start)
+
+    def stats(self):
+        return {"path": self.path, "records": self.records, "kb": round(self.bytes_written / 1024, 1)}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path):
+    """Yield (offset, kind, meta, blob) records from a SessionRecorder file."""
+    with open(path, "rb") as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            offset, kind, meta_len, blob_len = RECORD_HEADER.unpack(header)
+            meta_bytes = f.read(meta_len)
+            blob = f.read(blob_len)
+            if len(meta_bytes) < meta_len or len(blob) < blob_len:
+                return
+            yield offset, RECORD_KINDS[kind], json.loads(meta_bytes), blob
+
+
+def _downlink_message(meta, blob):
+    blob_sizes = meta.pop("_blob_sizes", [])
+    message = types.LiveServerMessage.model_validate(meta)
+    position = 0
+    parts = [part for part in _model_turn_parts(message) if part.inline_data]
+    for part, size in zip(parts, blob_sizes):
+        part.inline_data.data = blob[position:position + size]
+        position += size
+    return message
+
+
+def recording_to_script(records, speed=1.0):
+    """
+    Turn recorded downlink traffic into a FakeLiveSession script. speed
+    scales the original timing (2.0 = twice as fast); 0 replays as fast as
+    the loop can take it.
+    """
+    script = []
+    for offset, kind, meta, blob in records:
+        if kind != "downlink":
+            continue
+        if "tool_call" in meta:
+            event = {"type": "tool_call", "calls": [
+                {"id": fc.get("id"), "name": fc["name"], "args": fc.get("args") or {}}
+                for fc in meta["tool_call"].get("function_calls", [])
+            ]}
+        else:
+            event = {"type": "message", "message": _downlink_message(meta, blob)}
+        if speed > 0:
+            event["at"] = offset / speed
+        script.append(event)
+    return script
+
+
+class RecordedAudioBackend(SyntheticAudioBackend):
+    """
+    Synthetic audio backend whose mic plays back the recorded uplink audio
+    at its recorded offsets (scaled by speed; 0 plays the chunks back to
+    back), with silence in between, so the voice gate sees the same speech
+    and pauses as the live session.
+    """
+
+    def __init__(self, chunks, speed=1.0, rate=SEND_SAMPLE_RATE):
+        super().__init__()
+        pieces, end = [], 0
+        for offset, pcm in chunks:
+            start = max(end, int(round(offset / speed * rate))) if speed > 0 else end
+            samples = np.frombuffer(pcm, dtype=np.int16)
+            pieces.append((start, samples))
+            end = start + len(samples)
+        self.timeline = np.zeros(end, dtype=np.int16)
+        for start, samples in pieces:
+            self.timeline[start:start + len(samples)] = samples
+
+    def mic_signal(self, position, frame_count, rate=SEND_SAMPLE_RATE):
+        out = np.zeros(frame_count, dtype=np.int16)
+        chunk = self.timeline[position:position + frame_count]
+        out[:len(chunk)] = chunk
+        return out.tobytes()
+
+
+class RecordedScreenSource:
+    """
+    Screen source that cycles through the recorded screen frames. Frames are
+    decoded up front (at most max_frames, evenly spaced) so grab() costs
+    about what a real capture does instead of a JPEG decode. The frames
+    already show the cursor, so no overlay is drawn on them (has_cursor).
+    """
+
+    has_cursor = True
+
+    def __init__(self, frames, max_frames=REPLAY_MAX_FRAMES):
+        step = max(1, -(-len(frames) // max_frames))
+        self.frames = [
+            cv2.cvtColor(cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2BGRA)
+            for blob in frames[::step]
+        ]
+        self.grabs = 0
+
+    def grab(self):
+        frame = self.frames[self.grabs % len(self.frames)]
+        self.grabs += 1
+        return frame
+
+    def cursor_position(self):
+        return (0, 0)
+
+
+def recording_trace(records):
+    """Per-stage latency summaries of the spans in a recording."""
+    stages = {}
+    for offset, kind, meta, blob in records:
+        if kind == "span":
+            stages.setdefault(meta["stage"], LatencyStats()).add(meta["duration"])
+    return {stage: stats.summary() for stage, stats in stages.items()}
+
+
+def compare_traces(baseline, current, tolerance=REPLAY_REGRESSION_TOLERANCE):
+    """Per-stage p50/p95 deltas; a stage regresses when either grew by more than tolerance (and 1 ms)."""
+    comparison = {}
+    for stage in sorted(set(baseline) | set(current)):
+        before, after = baseline.get(stage), current.get(stage)
+        if before is None or after is None:
+            comparison[stage] = {"in_baseline": before is not None, "in_replay": after is not None}
+            continue
+        entry = {}
+        regressed = False
+        for key in ("p50_ms", "p95_ms"):
+            entry[key] = (before[key], after[key])
+            if after[key] > before[key] * (1 + tolerance) and after[key] - before[key] > 1.0:
+                regressed = True
+        entry["regressed"] = regressed
+        comparison[stage] = entry
+    return comparison
+
+
+async def replay_session(path, speed=1.0, baseline_path=None, vad_mode=DEFAULT_VAD_MODE,
+                         encoder=DEFAULT_FRAME_ENCODER):
+    """
+    Drive an AudioLoop from a recording with no network: the recorded
+    downlink (audio, tool calls, interruptions) is replayed by a
+    FakeLiveSession, the recorded uplink audio feeds the mic and typed text
+    is sent at its recorded offsets, recorded screen frames feed the screen
+    source, and tools run against the synthetic input backend. Compares per-stage
+    timings with the baseline recording (default: the replayed one).
+    Returns the list of regressed stages.
+    """
+    records = list(read_recording(path))
+    uplink = [(offset, meta, blob) for offset, kind, meta, blob in records if kind == "uplink"]
+    frames = [blob for offset, meta, blob in uplink if meta.get("lane") == "video"]
+    mic = [(offset, blob) for offset, meta, blob in uplink if meta.get("lane") == "audio"]
+    texts = [(offset / speed if speed > 0 else 0.0, meta["text"]) for offset, meta, blob in uplink if "text" in meta]
+    session = FakeLiveSession(recording_to_script(records, speed))
+    agent, result = await run_offline_session(
+        session, video_mode="screen" if frames else "none",
+        screen_source=RecordedScreenSource(frames) if frames else None,
+        audio=RecordedAudioBackend(mic, speed) if mic else None, texts=texts,
+        vad_mode=vad_mode, encoder=encoder)
+
+    baseline = recording_trace(records if baseline_path is None else list(read_recording(baseline_path)))
+    comparison = compare_traces(baseline, agent.stats()["trace"])
+    for key, value in result.items():
+        print(f"[REPLAY] {key}: {value}")
+    for stage, entry in comparison.items():
+        print(f"[REPLAY] {stage}: {entry}")
+    regressed = [stage for stage, entry in comparison.items() if entry.get("regressed")]
+    print(f"[REPLAY] regressed stages: {regressed or 'none'}")
+    return regressed
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -1002,6 +4601,123 @@ if __name__ == "__main__":
         help="pixels to stream from",
         choices=["camera", "screen", "none"],
     )
+    parser.add_argument(
+        "--encoder",
+        type=str,
+        default=DEFAULT_FRAME_ENCODER,
+        help="frame encoder backend",
+        choices=list(FRAME_ENCODERS),
+    )
+    parser.add_argument("--quality", type=int, default=FRAME_QUALITY, help="frame encoder quality (0-100)")
+    parser.add_argument("--max-frame-size", type=int, default=None,
+                        help="cap the longest side of streamed frames (pixels)")
+    parser.add_argument(
+        "--benchmark",
+        type=str,
+        default=None,
+        help="run an offline benchmark instead of a live session",
+        choices=["encoders", "capture", "detection", "session", "startup"],
+    )
+    parser.add_argument("--vad", type=str, default=DEFAULT_VAD_MODE, choices=list(VAD_MODES),
+                        help="local voice activity gate: signal turns (activity), end the stream (stream_end) or off")
+    parser.add_argument("--archive-screens", action="store_true",
+                        help="save the screenshots sent to the vision tools (written in the background)")
+    parser.add_argument("--detection-mode", type=str, default=DETECTION_MODE, choices=list(DETECTION_MODES),
+                        help="coordinate detection method: single-shot or coarse-to-fine")
+    parser.add_argument("--detection-manifest", type=str, default=None,
+                        help="JSON manifest of labelled screenshots for --benchmark detection")
+    parser.add_argument("--mouse-motion", type=str, default=MOUSE_MOTION_MODE, choices=list(MOUSE_MOTION_MODES),
+                        help="mouse movement style: instant jumps, linear or eased (duration scales with distance)")
+    parser.add_argument("--text-entry", type=str, default=TEXT_ENTRY_MODE, choices=list(TEXT_ENTRY_MODES),
+                        help="type_text strategy: auto pastes long text via the clipboard, type/paste force one")
+    parser.add_argument("--paste-min-chars", type=int, default=PASTE_MIN_CHARS,
+                        help="in auto mode, paste text at least this long (0 = always type)")
+    parser.add_argument("--trace-file", type=str, default=None,
+                        help="append pipeline latency spans to this JSONL file")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help=f"serve per-stage latency in Prometheus format on {METRICS_HOST}:PORT/metrics")
+    parser.add_argument("--bench-turns", type=int, default=5,
+                        help="--benchmark session: scripted model turns")
+    parser.add_argument("--bench-tool-calls", type=int, default=1,
+                        help="--benchmark session: tool calls per turn")
+    parser.add_argument("--bench-interrupt-every", type=int, default=0,
+                        help="--benchmark session: interrupt every Nth turn (0 = never)")
+    parser.add_argument("--record", type=str, default=None,
+                        help="record the session's Live API traffic, tool results and timings to this file")
+    parser.add_argument("--replay", type=str, default=None,
+                        help="replay a --record file offline instead of a live session")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="--replay timing: 1 = original, 2 = twice as fast, 0 = as fast as possible")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="--replay: recording whose stage timings to compare against (default: the replayed one)")
+    parser.add_argument("--synthetic-devices", action="store_true",
+                        help="--benchmark startup: use the synthetic mic/speaker instead of real audio devices")
+    parser.add_argument("--startup-probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--monitor", type=str, default=CAPTURE_MONITOR,
+                        help="screen to capture: all, cursor (monitor under the mouse) or a monitor index (1 = primary)")
+    parser.add_argument("--region", type=str, default=CAPTURE_REGION,
+                        help="narrow the capture: none, window (active window), target (around the last "
+                             "detected element) or x,y,w,h in global coordinates")
+    parser.add_argument("--capture-scale", type=str, default=CAPTURE_SCALE,
+                        help="screen image size: logical (mouse resolution, halves HiDPI/Retina pixels "
+                             "per side), native (physical pixels) or a max longest side in pixels")
+    parser.add_argument("--cursor-style", type=str, default=CURSOR_STYLE, choices=CURSOR_STYLES,
+                        help="cursor overlay drawn on the streamed screen")
+    parser.add_argument("--cursor-size", type=int, default=CURSOR_SIZE,
+                        help="cursor overlay size in pixels")
+    parser.add_argument("--grid-single-image", action="store_true",
+                        help="send one gridded screenshot to coordinate detection instead of three images")
     args = parser.parse_args()
-    main = AudioLoop(video_mode=args.mode)
+    GRID_SEND_SINGLE_IMAGE = args.grid_single_image
+    ARCHIVE_SCREENSHOTS = args.archive_screens
+    DETECTION_MODE = args.detection_mode
+    MOUSE_MOTION_MODE = args.mouse_motion
+    TEXT_ENTRY_MODE = args.text_entry
+    PASTE_MIN_CHARS = args.paste_min_chars
+    CAPTURE_MONITOR = args.monitor
+    CAPTURE_REGION = args.region
+    CAPTURE_SCALE = args.capture_scale
+    CURSOR_STYLE = args.cursor_style
+    CURSOR_SIZE = args.cursor_size
+    try:
+        parse_capture_scale(CAPTURE_SCALE)
+    except ValueError as e:
+        parser.error(str(e))
+    if CAPTURE_MONITOR not in ("all", "cursor") and not CAPTURE_MONITOR.isdigit():
+        parser.error("--monitor must be all, cursor or a monitor index")
+    if CAPTURE_REGION not in ("none", "window", "target"):
+        try:
+            CaptureRegion.parse(CAPTURE_REGION)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.benchmark == "encoders":
+        benchmark_frame_encoders(quality=args.quality, max_size=args.max_frame_size)
+        sys.exit(0)
+    if args.benchmark == "capture":
+        benchmark_capture_scale(encoder=args.encoder, quality=args.quality)
+        sys.exit(0)
+    if args.benchmark == "detection":
+        if not args.detection_manifest:
+            parser.error("--benchmark detection requires --detection-manifest")
+        asyncio.run(benchmark_detection(args.detection_manifest))
+        sys.exit(0)
+    if args.startup_probe:
+        asyncio.run(startup_probe(args.mode, synthetic_devices=args.synthetic_devices))
+        sys.exit(0)
+    if args.benchmark == "startup":
+        benchmark_startup(synthetic_devices=args.synthetic_devices)
+        sys.exit(0)
+    if args.benchmark == "session":
+        asyncio.run(benchmark_session(video_mode=args.mode, turns=args.bench_turns,
+                                      tool_calls=args.bench_tool_calls,
+                                      interrupt_every=args.bench_interrupt_every,
+                                      vad_mode=args.vad, encoder=args.encoder))
+        sys.exit(0)
+    if args.replay:
+        regressed = asyncio.run(replay_session(args.replay, speed=args.replay_speed, baseline_path=args.baseline,
+                                               vad_mode=args.vad, encoder=args.encoder))
+        sys.exit(1 if regressed else 0)
+    main = AudioLoop(video_mode=args.mode, encoder=args.encoder, quality=args.quality,
+                     max_frame_size=args.max_frame_size, vad_mode=args.vad,
+                     trace_file=args.trace_file, metrics_port=args.metrics_port, record_path=args.record)
     asyncio.run(main.run())
\ No newline at end of file